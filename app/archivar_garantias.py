@@ -0,0 +1,57 @@
+"""
+Script para archivar garantías cerradas (Resuelta, Rechazada, Abandonada) antiguas.
+- Mueve las garantías y sus comentarios a las tablas garantias_archivo / comentarios_archivo.
+- Trabaja por lotes; cada lote es una transacción.
+- Opcionalmente mueve los adjuntos a uploads/archivo/ comprimidos (--comprimir-adjuntos).
+- Las garantías archivadas se siguen pudiendo consultar por id, cédula o serial.
+
+Cómo ejecutar:
+
+  Si usas Docker:
+    docker exec -it garantias_app_v3_4 python archivar_garantias.py --dias 90
+
+  Si corres la app localmente desde la carpeta app/:
+    python archivar_garantias.py --dias 90 --comprimir-adjuntos
+    python archivar_garantias.py --dry-run     (solo muestra cuántas se archivarían)
+"""
+import os
+import sys
+import argparse
+
+# Ir a la carpeta app para que la BD (./data/garantias.db) y uploads coincidan con la app
+app_dir = os.path.dirname(os.path.abspath(__file__))
+if os.getcwd() != app_dir:
+    os.chdir(app_dir)
+sys.path.insert(0, app_dir)
+
+from database import SessionLocal
+from migraciones import aplicar_migraciones
+from archivo import archivar_garantias, DIAS_ARCHIVO, LOTE_ARCHIVO
+
+def main():
+    parser = argparse.ArgumentParser(description="Archiva garantías cerradas antiguas")
+    parser.add_argument("--dias", type=int, default=DIAS_ARCHIVO, help=f"Días mínimos desde el cierre de la garantía (por defecto {DIAS_ARCHIVO})")
+    parser.add_argument("--lote", type=int, default=LOTE_ARCHIVO, help=f"Garantías por transacción (por defecto {LOTE_ARCHIVO})")
+    parser.add_argument("--comprimir-adjuntos", action="store_true", help="Mover adjuntos a uploads/archivo/ comprimidos")
+    parser.add_argument("--dry-run", action="store_true", help="Solo contar, no modificar nada")
+    args = parser.parse_args()
+
+    aplicar_migraciones()
+    db = SessionLocal()
+    try:
+        total = archivar_garantias(db, dias=args.dias, lote=args.lote, comprimir_adjuntos=args.comprimir_adjuntos, dry_run=args.dry_run)
+        print("Simulación (no se modificó nada):" if args.dry_run else "Archivo completado:")
+        print(f"  - Garantías archivadas: {total['garantias']}")
+        print(f"  - Comentarios archivados: {total['comentarios']}")
+        if total.get("omitidas"):
+            print(f"  - Garantías omitidas (su id ya existe en el archivo): {total['omitidas']}")
+        if args.comprimir_adjuntos:
+            print(f"  - Adjuntos movidos a uploads/archivo: {total['adjuntos']}")
+    except Exception as e:
+        print(f"Error: {e}")
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
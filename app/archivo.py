@@ -0,0 +1,154 @@
+"""
+Archivo de garantías cerradas.
+
+Las garantías en estado cerrado (ver ESTADOS_CERRADOS) hace más de N días (fecha_cierre) se mueven,
+junto con sus comentarios, a las tablas garantias_archivo / comentarios_archivo.
+Así las consultas, listados y exportaciones diarias solo recorren las garantías activas.
+Las búsquedas por id, cédula o serial consultan también el archivo.
+"""
+import os, gzip, shutil
+from datetime import timedelta
+from sqlalchemy import text, or_
+from models import Garantia, Comentario, GarantiaArchivada, ComentarioArchivado, Cliente, ESTADOS_CERRADOS, now_colombia
+from clientes import normalizar_cedula
+from reincidencias import normalizar_codigo
+
+# Días tras los cuales una garantía cerrada se archiva (la política del recibo habla de 90 días)
+DIAS_ARCHIVO = int(os.environ.get("ARCHIVO_DIAS", "90"))
+LOTE_ARCHIVO = 500
+
+UPLOAD_DIR = os.path.join(os.getcwd(), "uploads")
+ARCHIVO_UPLOAD_DIR = os.path.join(UPLOAD_DIR, "archivo")
+# Ruta pública de los adjuntos movidos al archivo (servida por main.py)
+ARCHIVO_URL = "/uploads-archivo/"
+
+def _columnas_comunes(modelo_archivo, modelo_activo):
+    activas = set(modelo_activo.__table__.columns.keys())
+    return [c for c in modelo_archivo.__table__.columns.keys() if c in activas]
+
+def _mover_adjunto(path):
+    """Mueve /uploads/<archivo> a uploads/archivo/, comprimido con gzip si reduce tamaño.
+    Devuelve la nueva ruta pública o None si no se pudo mover."""
+    if not path or not path.startswith("/uploads/"):
+        return None
+    nombre = os.path.basename(path)
+    origen = os.path.join(UPLOAD_DIR, nombre)
+    if not os.path.isfile(origen):
+        return None
+    os.makedirs(ARCHIVO_UPLOAD_DIR, exist_ok=True)
+    destino_gz = os.path.join(ARCHIVO_UPLOAD_DIR, nombre + ".gz")
+    with open(origen, "rb") as f_in, gzip.open(destino_gz, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    if os.path.getsize(destino_gz) >= os.path.getsize(origen):
+        # Imágenes ya comprimidas (jpg, png...): se guardan tal cual
+        os.remove(destino_gz)
+        shutil.move(origen, os.path.join(ARCHIVO_UPLOAD_DIR, nombre))
+    else:
+        os.remove(origen)
+    return ARCHIVO_URL + nombre
+
+def ruta_adjunto_archivado(nombre):
+    """Devuelve (ruta_en_disco, comprimido) de un adjunto archivado, o (None, False)."""
+    nombre = os.path.basename(nombre)
+    gz = os.path.join(ARCHIVO_UPLOAD_DIR, nombre + ".gz")
+    if os.path.isfile(gz):
+        return gz, True
+    plano = os.path.join(ARCHIVO_UPLOAD_DIR, nombre)
+    if os.path.isfile(plano):
+        return plano, False
+    return None, False
+
+def _ids_repetidos(db, ids):
+    """Garantías del lote cuyo id (o el de alguno de sus comentarios) ya está en el archivo.
+    Solo pasa en bases en que SQLite reutilizó ids antes de AUTOINCREMENT (ver migraciones.py);
+    se dejan en la tabla activa para que el resto del archivo siga funcionando."""
+    repetidas = {r[0] for r in db.query(GarantiaArchivada.id).filter(GarantiaArchivada.id.in_(ids))}
+    repetidas.update(r[0] for r in db.query(Comentario.garantia_id).filter(Comentario.garantia_id.in_(ids), Comentario.id.in_(db.query(ComentarioArchivado.id))))
+    return repetidas
+
+def archivar_garantias(db, dias=DIAS_ARCHIVO, lote=LOTE_ARCHIVO, comprimir_adjuntos=False, dry_run=False):
+    """Mueve al archivo las garantías cerradas hace más de `dias` días.
+    Trabaja en lotes de `lote` garantías, cada uno en su propia transacción."""
+    corte = now_colombia() - timedelta(days=dias)
+    filtro = (Garantia.estado.in_(ESTADOS_CERRADOS), Garantia.fecha_cierre < corte)
+    if dry_run:
+        ids = db.query(Garantia.id).filter(*filtro)
+        return {
+            "garantias": db.query(Garantia).filter(*filtro).count(),
+            "comentarios": db.query(Comentario).filter(Comentario.garantia_id.in_(ids)).count(),
+            "adjuntos": 0,
+        }
+
+    cols_g = ", ".join(_columnas_comunes(GarantiaArchivada, Garantia))
+    cols_c = ", ".join(_columnas_comunes(ComentarioArchivado, Comentario))
+    total = {"garantias": 0, "comentarios": 0, "adjuntos": 0, "omitidas": 0}
+    ultimo_id = 0
+    while True:
+        ids = [r[0] for r in db.query(Garantia.id).filter(*filtro, Garantia.id > ultimo_id).order_by(Garantia.id).limit(lote).all()]
+        if not ids:
+            break
+        ultimo_id = ids[-1]
+        repetidas = _ids_repetidos(db, ids)
+        if repetidas:
+            total["omitidas"] += len(repetidas)
+            ids = [i for i in ids if i not in repetidas]
+            if not ids:
+                continue
+        params = {f"id{i}": v for i, v in enumerate(ids)}
+        en_lote = "(" + ", ".join(f":id{i}" for i in range(len(ids))) + ")"
+        try:
+            db.execute(text(f"INSERT INTO garantias_archivo ({cols_g}, fecha_archivo) SELECT {cols_g}, :ahora FROM garantias WHERE id IN {en_lote}"), {**params, "ahora": now_colombia()})
+            r = db.execute(text(f"INSERT INTO comentarios_archivo ({cols_c}) SELECT {cols_c} FROM comentarios WHERE garantia_id IN {en_lote}"), params)
+            total["comentarios"] += r.rowcount
+            db.execute(text(f"DELETE FROM comentarios WHERE garantia_id IN {en_lote}"), params)
+            db.execute(text(f"DELETE FROM garantias WHERE id IN {en_lote}"), params)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        total["garantias"] += len(ids)
+
+        if comprimir_adjuntos:
+            # Los archivos se mueven después del commit: si algo falla, las rutas originales siguen siendo válidas
+            for g in db.query(GarantiaArchivada).filter(GarantiaArchivada.id.in_(ids)).all():
+                nueva = _mover_adjunto(g.imagen_path)
+                if nueva:
+                    g.imagen_path = nueva
+                    total["adjuntos"] += 1
+            for c in db.query(ComentarioArchivado).filter(ComentarioArchivado.garantia_id.in_(ids)).all():
+                nueva = _mover_adjunto(c.attachment_path)
+                if nueva:
+                    c.attachment_path = nueva
+                    total["adjuntos"] += 1
+            db.commit()
+    return total
+
+# Búsquedas que consultan primero las garantías activas y luego el archivo
+def obtener_garantia(db, gid):
+    garantia = db.query(Garantia).filter(Garantia.id == gid).first()
+    if garantia:
+        return garantia
+    return db.query(GarantiaArchivada).filter(GarantiaArchivada.id == gid).first()
+
+def es_archivada(garantia):
+    return isinstance(garantia, GarantiaArchivada)
+
+def comentarios_de(db, gid):
+    comentarios = db.query(Comentario).filter(Comentario.garantia_id == gid).order_by(Comentario.id.asc()).all()
+    if comentarios:
+        return comentarios
+    return db.query(ComentarioArchivado).filter(ComentarioArchivado.garantia_id == gid).order_by(ComentarioArchivado.id.asc()).all()
+
+def buscar_garantias(db, cedula=None, serial=None):
+    """Garantías (activas y archivadas) que coinciden con la cédula y/o el serial dados."""
+    out = []
+    cliente = db.query(Cliente).filter(Cliente.cedula == normalizar_cedula(cedula)).first() if cedula else None
+    for modelo in (Garantia, GarantiaArchivada):
+        q = db.query(modelo)
+        if cedula:
+            # Por cliente_id se encuentran también las registradas con la cédula escrita de otra forma
+            q = q.filter(or_(modelo.cedula == cedula, modelo.cliente_id == cliente.id) if cliente else modelo.cedula == cedula)
+        if serial:
+            q = q.filter(modelo.serial_norm == normalizar_codigo(serial))
+        out.extend(q.order_by(modelo.id.desc()).all())
+    return out
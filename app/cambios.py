@@ -0,0 +1,165 @@
+"""
+Historial de cambios de garantías, comentarios y configuración de empresa.
+
+Un evento after_flush de la sesión compara cada objeto modificado con sus valores cargados y
+guarda en la tabla "cambios" solo los campos que cambiaron ({"estado": ["Recibido", "Enviado"]}),
+todos los del flush en un único INSERT. Al crear o borrar se guarda solo la acción: la fila
+misma ya es la foto completa. El usuario se toma de db.info["usuario"], que fijan los
+endpoints de escritura.
+
+Las operaciones masivas (query.delete(), INSERT ... SELECT del archivo) no pasan por el flush
+y no quedan registradas.
+
+compactar_cambios() fusiona las ediciones seguidas de un mismo usuario sobre la misma entidad
+en el mismo día, una vez pasados DIAS_COMPACTAR; purgar_cambios() borra los de más de
+DIAS_RETENCION. Los ejecuta el trabajo "historial" y `mantenimiento.py historial`.
+"""
+import os
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import event, insert, inspect, tuple_
+from database import SessionLocal
+from models import Garantia, Comentario, ConfiguracionEmpresa, Cambio, now_colombia
+
+DIAS_COMPACTAR = int(os.environ.get("CAMBIOS_COMPACTAR_DIAS", "30"))
+DIAS_RETENCION = int(os.environ.get("CAMBIOS_RETENCION_DIAS", "730"))
+LOTE = 500
+
+# Campos derivados o de control que no aportan al historial
+IGNORAR = {"id", "serial_norm", "factura_norm", "cliente_id", "fecha_actualizacion", "fecha_cierre"}
+
+# modelo -> (nombre de la entidad, función que da el garantia_id)
+ENTIDADES = {
+    Garantia: ("garantia", lambda o: o.id),
+    Comentario: ("comentario", lambda o: o.garantia_id),
+    ConfiguracionEmpresa: ("configuracion", lambda o: None),
+}
+
+_columnas = {}
+
+def _columnas_de(modelo):
+    if modelo not in _columnas:
+        _columnas[modelo] = [a.key for a in inspect(modelo).column_attrs if a.key not in IGNORAR]
+    return _columnas[modelo]
+
+def _valor(v):
+    return v.isoformat(timespec="seconds") if isinstance(v, datetime) else v
+
+def _json(cambios):
+    return json.dumps(cambios, ensure_ascii=False, separators=(",", ":"))
+
+def diferencias(obj):
+    """{"campo": [antes, después]} de los campos de `obj` modificados en la sesión."""
+    estado = inspect(obj)
+    out = {}
+    for key in _columnas_de(type(obj)):
+        historia = estado.attrs[key].history
+        if not historia.has_changes():
+            continue
+        antes = _valor(historia.deleted[0]) if historia.deleted else None
+        despues = _valor(historia.added[0]) if historia.added else None
+        if antes != despues:
+            out[key] = [antes, despues]
+    return out
+
+@event.listens_for(SessionLocal, "after_flush")
+def _registrar_cambios(session, flush_context):
+    # En after_flush los objetos nuevos ya tienen id y la historia de atributos sigue disponible
+    filas = []
+    usuario = session.info.get("usuario")
+    for grupo, accion in ((session.new, "crear"), (session.dirty, "editar"), (session.deleted, "borrar")):
+        for obj in grupo:
+            entidad = ENTIDADES.get(type(obj))
+            if not entidad:
+                continue
+            cambios = None
+            if accion == "editar":
+                cambios = diferencias(obj)
+                if not cambios:
+                    continue
+                cambios = _json(cambios)
+            nombre, garantia_de = entidad
+            filas.append({"entidad": nombre, "entidad_id": obj.id, "garantia_id": garantia_de(obj), "accion": accion, "cambios": cambios, "usuario": usuario, "fecha": now_colombia(), "compactado": False})
+    if filas:
+        session.connection().execute(insert(Cambio), filas)
+
+def historial(db, garantia_id, limite=100, antes_de=None):
+    """Cambios de la garantía y sus comentarios, del más reciente al más antiguo.
+    `antes_de` (id de cambio) pagina hacia atrás usando el índice (garantia_id, id)."""
+    q = db.query(Cambio).filter(Cambio.garantia_id == garantia_id)
+    if antes_de:
+        q = q.filter(Cambio.id < antes_de)
+    return q.order_by(Cambio.id.desc()).limit(limite).all()
+
+def cambio_dict(c):
+    return {"id": c.id, "entidad": c.entidad, "entidad_id": c.entidad_id, "accion": c.accion, "cambios": json.loads(c.cambios) if c.cambios else None, "usuario": c.usuario, "fecha": c.fecha.isoformat()}
+
+def _fusionar(grupo):
+    """Une las ediciones del grupo: primer "antes" y último "después" de cada campo."""
+    fusion = {}
+    for c in grupo:
+        for campo, (antes, despues) in json.loads(c.cambios).items():
+            if campo in fusion:
+                fusion[campo][1] = despues
+            else:
+                fusion[campo] = [antes, despues]
+    return {campo: v for campo, v in fusion.items() if v[0] != v[1]}
+
+def compactar_cambios(db, dias=DIAS_COMPACTAR, lote=LOTE, dry_run=False, progreso=None):
+    """Fusiona las ediciones consecutivas de un mismo usuario sobre la misma entidad en el mismo
+    día, para los cambios con más de `dias` días. Devuelve cuántas filas se eliminan."""
+    corte = datetime.combine((now_colombia() - timedelta(days=dias)).date(), datetime.min.time())
+    pendiente = (Cambio.compactado == False, Cambio.fecha < corte)  # noqa: E712
+    entidades = db.query(Cambio.entidad, Cambio.entidad_id).filter(*pendiente).distinct().all()
+    eliminadas = 0
+    for i in range(0, len(entidades), lote):
+        tramo = entidades[i:i + lote]
+        filas = db.query(Cambio).filter(*pendiente, tuple_(Cambio.entidad, Cambio.entidad_id).in_(tramo)).order_by(Cambio.entidad, Cambio.entidad_id, Cambio.id).all()
+        borrar, grupo = [], []
+
+        def cerrar_grupo():
+            if len(grupo) > 1:
+                fusion = _fusionar(grupo)
+                if fusion:
+                    grupo[0].cambios = _json(fusion)
+                    borrar.extend(c.id for c in grupo[1:])
+                else:
+                    borrar.extend(c.id for c in grupo)
+
+        for c in filas:
+            anterior = grupo[-1] if grupo else None
+            if anterior and not (c.accion == "editar" and (c.entidad, c.entidad_id, c.usuario, c.fecha.date()) == (anterior.entidad, anterior.entidad_id, anterior.usuario, anterior.fecha.date())):
+                cerrar_grupo()
+                grupo = []
+            if c.accion == "editar":
+                grupo.append(c)
+        cerrar_grupo()
+        eliminadas += len(borrar)
+        if dry_run:
+            db.rollback()
+            continue
+        try:
+            if borrar:
+                db.query(Cambio).filter(Cambio.id.in_(borrar)).delete(synchronize_session=False)
+            db.query(Cambio).filter(*pendiente, tuple_(Cambio.entidad, Cambio.entidad_id).in_(tramo)).update({Cambio.compactado: True}, synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        if progreso:
+            progreso(100 * (i + len(tramo)) / len(entidades))
+    return eliminadas
+
+def purgar_cambios(db, dias=DIAS_RETENCION, lote=LOTE, dry_run=False):
+    """Borra por lotes los cambios con más de `dias` días."""
+    corte = now_colombia() - timedelta(days=dias)
+    if dry_run:
+        return db.query(Cambio).filter(Cambio.fecha < corte).count()
+    total = 0
+    while True:
+        ids = [f[0] for f in db.query(Cambio.id).filter(Cambio.fecha < corte).order_by(Cambio.id).limit(lote)]
+        if not ids:
+            return total
+        db.query(Cambio).filter(Cambio.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        total += len(ids)
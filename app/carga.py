@@ -0,0 +1,61 @@
+"""
+Carga de trabajo por técnico (garantías abiertas asignadas a cada usuario).
+
+Se mantiene en la tabla carga_tecnicos, actualizada en la misma transacción que
+crea, cierra o reasigna la garantía, y se recalcula completa al arrancar la app
+(y tras una purga) por si algún script la desincronizó.
+"""
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Garantia, Usuario, CargaTecnico, ESTADOS_CERRADOS
+
+def esta_abierta(estado):
+    return estado not in ESTADOS_CERRADOS
+
+def ajustar_carga(db, username, delta):
+    """Suma `delta` a las garantías abiertas de `username`. No hace commit."""
+    if not username or not delta:
+        return
+    # Un solo INSERT ... ON CONFLICT: dos altas simultáneas del mismo técnico no chocan con la clave primaria
+    db.execute(sqlite_insert(CargaTecnico).values(username=username, abiertas=max(delta, 0)).on_conflict_do_update(
+        index_elements=["username"],
+        set_={"abiertas": CargaTecnico.abiertas + delta},
+    ))
+
+def cambio_estado(db, username, anterior, nuevo):
+    if esta_abierta(anterior) and not esta_abierta(nuevo):
+        ajustar_carga(db, username, -1)
+    elif not esta_abierta(anterior) and esta_abierta(nuevo):
+        ajustar_carga(db, username, 1)
+
+def reasignacion(db, garantia, anterior, nuevo):
+    if anterior != nuevo and esta_abierta(garantia.estado):
+        ajustar_carga(db, anterior, -1)
+        ajustar_carga(db, nuevo, 1)
+
+def tecnico_menos_cargado(db):
+    """Username del técnico con menos garantías abiertas (None si no hay técnicos)."""
+    fila = (
+        db.query(Usuario.username)
+        .outerjoin(CargaTecnico, CargaTecnico.username == Usuario.username)
+        .filter(Usuario.rol == "tecnico")
+        .order_by(func.coalesce(CargaTecnico.abiertas, 0), Usuario.username)
+        .first()
+    )
+    return fila[0] if fila else None
+
+def recalcular_carga(db):
+    """Reconstruye carga_tecnicos a partir de las garantías abiertas."""
+    conteos = (
+        db.query(Garantia.usuario_asignado, func.count(Garantia.id))
+        .filter(Garantia.usuario_asignado.isnot(None), Garantia.estado.notin_(ESTADOS_CERRADOS))
+        .group_by(Garantia.usuario_asignado)
+        .all()
+    )
+    try:
+        db.query(CargaTecnico).delete()
+        db.add_all([CargaTecnico(username=u, abiertas=n) for u, n in conteos])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
@@ -0,0 +1,85 @@
+"""
+Clientes únicos por cédula.
+
+Cada garantía nueva se vincula (cliente_id) al cliente de su cédula, creándolo si no existe.
+vincular_garantias() hace lo mismo por lotes con las garantías anteriores, fusionando las
+que tienen la misma cédula escrita de formas distintas ("1.023.456" y "1023456").
+"""
+import re
+import unicodedata
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Cliente, Garantia, GarantiaArchivada
+
+LOTE_VINCULAR = 500
+LIMITE_SUGERENCIAS = 10
+
+def normalizar_cedula(cedula):
+    """Quita puntos, guiones y espacios: "1.023.456-7" -> "10234567"."""
+    return re.sub(r"[^0-9A-Za-z]", "", cedula or "").upper()
+
+def normalizar_nombre(nombre):
+    sin_tildes = unicodedata.normalize("NFKD", nombre or "").encode("ascii", "ignore").decode("ascii")
+    return " ".join(sin_tildes.lower().split())
+
+def registrar_cliente(db, cedula, nombre, telefono=None, email=None):
+    """Devuelve el cliente de esa cédula, creándolo si no existe y actualizando sus datos
+    de contacto con los no vacíos. No hace commit. Devuelve None si la cédula está vacía."""
+    cedula_norm = normalizar_cedula(cedula)
+    if not cedula_norm:
+        return None
+    # INSERT OR IGNORE: dos altas simultáneas de la misma cédula no chocan con el índice único
+    db.execute(sqlite_insert(Cliente).values(cedula=cedula_norm, nombre=nombre or cedula_norm, nombre_busqueda=normalizar_nombre(nombre)).on_conflict_do_nothing(index_elements=["cedula"]))
+    cliente = db.query(Cliente).filter(Cliente.cedula == cedula_norm).one()
+    if nombre and cliente.nombre != nombre:
+        cliente.nombre = nombre
+        cliente.nombre_busqueda = normalizar_nombre(nombre)
+    if telefono:
+        cliente.telefono = telefono
+    if email:
+        cliente.email = email
+    return cliente
+
+def sugerir(db, prefix, limite=LIMITE_SUGERENCIAS):
+    """Clientes cuya cédula o nombre empieza por `prefix`.
+    Se usan rangos (>= prefix y < prefix + U+FFFF) para que SQLite recorra solo el tramo del índice."""
+    cedula = normalizar_cedula(prefix)
+    nombre = normalizar_nombre(prefix)
+    out, vistos = [], set()
+    if cedula:
+        for c in db.query(Cliente).filter(Cliente.cedula >= cedula, Cliente.cedula < cedula + "\uffff").order_by(Cliente.cedula).limit(limite):
+            out.append(c)
+            vistos.add(c.id)
+    if nombre and len(out) < limite:
+        for c in db.query(Cliente).filter(Cliente.nombre_busqueda >= nombre, Cliente.nombre_busqueda < nombre + "\uffff").order_by(Cliente.nombre_busqueda).limit(limite):
+            if c.id not in vistos and len(out) < limite:
+                out.append(c)
+    return out
+
+def cliente_dict(c):
+    return {"id": c.id, "cedula": c.cedula, "nombre": c.nombre, "telefono": c.telefono, "email": c.email}
+
+def vincular_garantias(db, lote=LOTE_VINCULAR, progreso=None):
+    """Crea/fusiona clientes a partir de las garantías (activas y archivadas) sin cliente_id.
+    Procesa por id ascendente, así los datos de contacto más recientes quedan en el cliente."""
+    total = sum(db.query(modelo).filter(modelo.cliente_id.is_(None)).count() for modelo in (Garantia, GarantiaArchivada))
+    hechas = 0
+    for modelo in (Garantia, GarantiaArchivada):
+        ultimo_id = 0
+        while True:
+            garantias = db.query(modelo).filter(modelo.cliente_id.is_(None), modelo.id > ultimo_id).order_by(modelo.id).limit(lote).all()
+            if not garantias:
+                break
+            ultimo_id = garantias[-1].id
+            try:
+                for g in garantias:
+                    cliente = registrar_cliente(db, g.cedula, g.cliente, g.telefono, g.email)
+                    if cliente:
+                        g.cliente_id = cliente.id
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            hechas += len(garantias)
+            if progreso and total:
+                progreso(100 * hechas / total)
+    return hechas
@@ -0,0 +1,52 @@
+"""
+Peticiones idempotentes con el header Idempotency-Key.
+
+El cliente genera una clave única por operación y la repite en cada reintento. La respuesta
+se guarda en claves_idempotencia dentro de la MISMA transacción que la operación: si la
+operación se confirma, la clave también, y un reintento recibe la respuesta guardada en vez
+de volver a crear la garantía, el comentario o el cambio de estado. Si dos reintentos llegan a
+la vez, el segundo choca con la clave primaria al hacer commit y devuelve la del primero.
+"""
+import os
+import json
+from datetime import timedelta
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import IntegrityError
+from models import ClaveIdempotencia, now_colombia
+
+DIAS_RETENCION = int(os.environ.get("IDEMPOTENCIA_DIAS", "30"))
+
+def respuesta_previa(db, clave, usuario, ruta):
+    """JSONResponse guardada para la clave, o None si la clave es nueva (o no se envió)."""
+    if not clave:
+        return None
+    previa = db.get(ClaveIdempotencia, clave)
+    if not previa:
+        return None
+    if previa.usuario != usuario or previa.ruta != ruta:
+        raise HTTPException(status_code=422, detail="Idempotency-Key ya usada en otra petición")
+    return JSONResponse(content=json.loads(previa.respuesta), headers={"Idempotent-Replayed": "true"})
+
+def confirmar(db, clave, usuario, ruta, respuesta):
+    """Guarda la respuesta con la clave y hace commit de toda la operación.
+    Devuelve la respuesta a enviar: la nueva o, si otra petición con la misma clave ganó, la suya."""
+    if clave:
+        db.add(ClaveIdempotencia(clave=clave, usuario=usuario, ruta=ruta, respuesta=json.dumps(respuesta, ensure_ascii=False, default=str)))
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        previa = respuesta_previa(db, clave, usuario, ruta)
+        if previa is None:
+            raise
+        return previa
+    return respuesta
+
+def purgar_claves(db, dias=DIAS_RETENCION, dry_run=False):
+    q = db.query(ClaveIdempotencia).filter(ClaveIdempotencia.fecha < now_colombia() - timedelta(days=dias))
+    if dry_run:
+        return q.count()
+    n = q.delete(synchronize_session=False)
+    db.commit()
+    return n
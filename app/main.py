@@ -1,32 +1,29 @@
 import os, uuid, shutil
 from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Depends, Response
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
-from database import SessionLocal, engine, Base
-from models import Garantia, Comentario, Usuario, ConfiguracionEmpresa, now_colombia
+from database import SessionLocal
+from models import Garantia, Comentario, Usuario, ConfiguracionEmpresa, GarantiaArchivada, Trabajo, ESTADOS_CERRADOS, now_colombia
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
 from security import create_token, verify_token
 from sqlalchemy.exc import IntegrityError
-from datetime import datetime
-
-# create tables
-Base.metadata.create_all(bind=engine)
-
-# Migración: añadir columna email a garantias si no existe
-def ensure_email_column():
-    from sqlalchemy import text
-    with engine.connect() as conn:
-        try:
-            r = conn.execute(text("PRAGMA table_info(garantias)"))
-            cols = [row[1] for row in r.fetchall()]
-            if "email" not in cols:
-                conn.execute(text("ALTER TABLE garantias ADD COLUMN email VARCHAR"))
-                conn.commit()
-        except Exception:
-            pass
-ensure_email_column()
+from datetime import timedelta
+from migraciones import aplicar_migraciones
+from archivo import obtener_garantia, es_archivada, comentarios_de, buscar_garantias, ruta_adjunto_archivado
+import carga
+from recibos import generar_pdf_recibos
+import trabajos
+import clientes
+import reincidencias
+import notificaciones
+import cambios
+import idempotencia
+import tareas  # noqa: F401  (registra las tareas de la cola de trabajos)
+
+# create tables + migraciones de columnas
+aplicar_migraciones()
 
 app = FastAPI(title="Garantías JD Soluciones - v3.4", version="3.4", docs_url="/docs", redoc_url="/redoc", openapi_url="/openapi.json")
 
@@ -45,6 +42,30 @@ def get_db():
 def read_root():
     return FileResponse("static/index.html", media_type="text/html")
 
+# Service worker de la interfaz offline; se sirve desde la raíz para que controle todo el sitio
+@app.get("/sw.js")
+def service_worker():
+    return FileResponse("static/sw.js", media_type="application/javascript", headers={"Cache-Control": "no-cache"})
+
+# Adjuntos de garantías archivadas (pueden estar comprimidos con gzip)
+@app.get("/uploads-archivo/{nombre}")
+def adjunto_archivado(nombre: str):
+    import gzip, mimetypes
+    path, comprimido = ruta_adjunto_archivado(nombre)
+    if not path:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    media_type = mimetypes.guess_type(nombre)[0] or "application/octet-stream"
+    if not comprimido:
+        return FileResponse(path, media_type=media_type)
+    with gzip.open(path, "rb") as f:
+        return Response(content=f.read(), media_type=media_type)
+
+def garantia_dict(g):
+    d = {"id": g.id, "cliente": g.cliente, "cedula": g.cedula, "telefono": g.telefono, "email": g.email, "tipo_producto": g.tipo_producto, "marca": g.marca, "modelo": g.modelo, "serial": g.serial, "factura": g.factura, "fecha_compra": g.fecha_compra, "descripcion_falla": g.descripcion_falla, "imagen_path": g.imagen_path, "usuario_asignado": g.usuario_asignado, "estado": g.estado, "prioridad": g.prioridad or 0, "fecha_registro": g.fecha_registro.isoformat()}
+    if es_archivada(g):
+        d["archivada"] = True
+    return d
+
 class LoginIn(BaseModel):
     username: str
     password: str
@@ -75,6 +96,9 @@ class EmpresaConfigUpdate(BaseModel):
     ciudad: Optional[str] = None
     nit: Optional[str] = None
 
+class RecibosIn(BaseModel):
+    ids: List[int]
+
 # init admin
 def init_admin():
     db = SessionLocal()
@@ -109,8 +133,77 @@ def init_empresa_config():
             db.rollback()
     db.close()
 
+@app.on_event("startup")
+def precargar_modulos():
+    """Importa al arrancar el worker los módulos pesados que usan exportar y recibo,
+    para que el primer usuario que los pida no pague el tiempo de importación."""
+    import openpyxl  # noqa: F401
+    from reportlab.platypus import SimpleDocTemplate  # noqa: F401
+    from reportlab.lib.styles import getSampleStyleSheet
+    getSampleStyleSheet()
+    from passlib.context import CryptContext
+    CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+
+@app.on_event("startup")
+def iniciar_trabajos():
+    trabajos.iniciar_workers()
+
+@app.on_event("shutdown")
+def detener_trabajos():
+    trabajos.detener_workers()
+
+@app.on_event("startup")
+def iniciar_notificaciones():
+    notificaciones.iniciar_despachador()
+
+@app.on_event("shutdown")
+def detener_notificaciones():
+    notificaciones.detener_despachador()
+
+def init_carga_tecnicos():
+    db = SessionLocal()
+    try:
+        carga.recalcular_carga(db)
+    finally:
+        db.close()
+
+def init_clientes():
+    # Bases anteriores a la tabla clientes: vincular sus garantías en segundo plano
+    db = SessionLocal()
+    try:
+        sin_cliente = db.query(Garantia.id).filter(Garantia.cliente_id.is_(None), Garantia.cedula.isnot(None), Garantia.cedula != "").first()
+        pendiente = db.query(Trabajo.id).filter(Trabajo.tipo == "vincular_clientes", Trabajo.estado.in_(("pendiente", "en_proceso"))).first()
+        if sin_cliente and not pendiente:
+            trabajos.encolar(db, "vincular_clientes")
+    finally:
+        db.close()
+
+def init_reincidencias():
+    # Bases anteriores a serial_norm/factura_norm: normalizar y construir el reporte en segundo plano
+    db = SessionLocal()
+    try:
+        pendiente = db.query(Trabajo.id).filter(Trabajo.tipo == "reincidencias", Trabajo.estado.in_(("pendiente", "en_proceso"))).first()
+        if reincidencias.hay_pendientes(db) and not pendiente:
+            trabajos.encolar(db, "reincidencias")
+    finally:
+        db.close()
+
+@trabajos.periodica(timedelta(hours=1))
+def programar_historial(db):
+    # Retención y compactación del historial de cambios, como máximo una vez al día
+    reciente = db.query(Trabajo.id).filter(Trabajo.tipo == "historial", Trabajo.fecha_creacion > now_colombia() - timedelta(days=1)).first()
+    if not reciente:
+        trabajos.encolar(db, "historial")
+
+# Limpiezas de tablas que crecen con el uso, repetidas por los workers mientras la app sigue en marcha
+trabajos.periodica(timedelta(hours=6))(idempotencia.purgar_claves)
+trabajos.periodica(timedelta(hours=6))(notificaciones.limpiar_enviadas)
+
 init_admin()
 init_empresa_config()
+init_carga_tecnicos()
+init_clientes()
+init_reincidencias()
 
 # USERS - endpoint público para obtener lista de usuarios (para selects)
 @app.get("/api/usuarios-lista")
@@ -258,6 +351,7 @@ def actualizar_configuracion_empresa(config: EmpresaConfigUpdate, token: str = H
     dbuser = db.query(Usuario).filter(Usuario.username==username).first()
     if not dbuser or dbuser.rol != "admin":
         raise HTTPException(status_code=403, detail="Solo admin puede actualizar configuración")
+    db.info["usuario"] = username
     
     empresa_config = db.query(ConfiguracionEmpresa).first()
     if not empresa_config:
@@ -291,6 +385,7 @@ async def subir_logo_empresa(logo: UploadFile = File(...), token: str = Header(N
     dbuser = db.query(Usuario).filter(Usuario.username==username).first()
     if not dbuser or dbuser.rol != "admin":
         raise HTTPException(status_code=403, detail="Solo admin puede subir logo")
+    db.info["usuario"] = username
     
     if not logo.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="El archivo debe ser una imagen")
@@ -331,11 +426,19 @@ async def crear_garantia_api(
     fecha_compra: Optional[str] = Form(None),
     descripcion_falla: str = Form(...),
     usuario_asignado: Optional[str] = Form(None),
+    es_prueba: bool = Form(False),
+    prioridad: int = Form(0),
     imagen: Optional[UploadFile] = File(None),
     token: str = Header(None),
+    idempotency_key: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
     username = verify_token(token)
+    # Reintento de una creación ya hecha (cola offline de la interfaz): misma respuesta, sin duplicar
+    previa = idempotencia.respuesta_previa(db, idempotency_key, username, "POST /api/garantias")
+    if previa is not None:
+        return previa
+    db.info["usuario"] = username
     imagen_path = None
     if imagen:
         ext = os.path.splitext(imagen.filename)[1]
@@ -347,38 +450,122 @@ async def crear_garantia_api(
     
     # Si no se especifica usuario_asignado, asignar al usuario que crea la garantía
     asignado_a = usuario_asignado if usuario_asignado else username
+    # "auto": asignar al técnico con menos garantías abiertas
+    if usuario_asignado == "auto":
+        asignado_a = carga.tecnico_menos_cargado(db) or username
+    
+    cliente_obj = clientes.registrar_cliente(db, cedula, cliente, telefono, email)
     
-    nueva = Garantia(cliente=cliente, cedula=cedula, telefono=telefono, email=email, tipo_producto=tipo_producto, marca=marca, modelo=modelo, serial=serial, factura=factura, fecha_compra=fecha_compra, descripcion_falla=descripcion_falla, imagen_path=imagen_path, usuario_asignado=asignado_a, estado="Recibido")
+    # Reincidencias: garantías previas del mismo serial/factura (una consulta indexada)
+    previas = reincidencias.previas(db, serial=serial, factura=factura)
+    advertencias = reincidencias.advertencias(previas, serial=serial, factura=factura)
+    serial_norm = reincidencias.normalizar_codigo(serial)
+    reincidente = bool(serial_norm) and any(reincidencias.normalizar_codigo(p["serial"]) == serial_norm for p in previas)
+    
+    nueva = Garantia(cliente=cliente, cedula=cedula, cliente_id=cliente_obj.id if cliente_obj else None, telefono=telefono, email=email, tipo_producto=tipo_producto, marca=marca, modelo=modelo, serial=serial, factura=factura, fecha_compra=fecha_compra, descripcion_falla=descripcion_falla, imagen_path=imagen_path, usuario_asignado=asignado_a, estado="Recibido", es_prueba=es_prueba, prioridad=prioridad, serial_norm=serial_norm, factura_norm=reincidencias.normalizar_codigo(factura))
     db.add(nueva)
-    db.commit()
-    db.refresh(nueva)
-    return {"id": nueva.id, "cliente": nueva.cliente, "cedula": nueva.cedula, "telefono": nueva.telefono, "email": nueva.email, "tipo_producto": nueva.tipo_producto, "marca": nueva.marca, "modelo": nueva.modelo, "serial": nueva.serial, "usuario_asignado": nueva.usuario_asignado, "estado": nueva.estado, "fecha_registro": nueva.fecha_registro.isoformat()}
+    carga.ajustar_carga(db, asignado_a, 1)
+    reincidencias.contar_garantia(db, marca, modelo, reincidente)
+    # Aviso al cliente con el recibo adjunto; lo envía el despachador, no esta petición
+    notificaciones.encolar(db, nueva, "registro", usuario=username)
+    db.flush()
+    respuesta = {"id": nueva.id, "cliente": nueva.cliente, "cedula": nueva.cedula, "telefono": nueva.telefono, "email": nueva.email, "tipo_producto": nueva.tipo_producto, "marca": nueva.marca, "modelo": nueva.modelo, "serial": nueva.serial, "usuario_asignado": nueva.usuario_asignado, "prioridad": nueva.prioridad, "estado": nueva.estado, "fecha_registro": nueva.fecha_registro.isoformat(), "advertencias": advertencias, "previas": previas}
+    return idempotencia.confirmar(db, idempotency_key, username, "POST /api/garantias", respuesta)
+
+# Búsqueda por cédula y/o serial (incluye garantías archivadas)
+@app.get("/api/garantias/buscar")
+def buscar_garantias_api(cedula: Optional[str] = None, serial: Optional[str] = None, token: str = Header(None), db: Session = Depends(get_db)):
+    verify_token(token)
+    if not cedula and not serial:
+        raise HTTPException(status_code=400, detail="Indique cédula o serial")
+    return [garantia_dict(g) for g in buscar_garantias(db, cedula=cedula, serial=serial)]
+
+# Garantías previas de un equipo por serial y/o factura (incluye archivadas)
+@app.get("/api/garantias/previas")
+def garantias_previas(serial: Optional[str] = None, factura: Optional[str] = None, token: str = Header(None), db: Session = Depends(get_db)):
+    verify_token(token)
+    if not serial and not factura:
+        raise HTTPException(status_code=400, detail="Indique serial o factura")
+    previas = reincidencias.previas(db, serial=serial, factura=factura)
+    return {"previas": previas, "advertencias": reincidencias.advertencias(previas, serial=serial, factura=factura)}
 
 @app.get("/api/garantias/{gid}")
 def obtener_garantia_api(gid: int, db: Session = Depends(get_db), token: str = Header(None)):
     verify_token(token)  # Solo verificar token, sin restricción de permisos para leer detalles
-    garantia = db.query(Garantia).filter(Garantia.id == gid).first()
+    garantia = obtener_garantia(db, gid)
     if not garantia:
         raise HTTPException(status_code=404, detail="Garantía no encontrada")
-    return {"id": garantia.id, "cliente": garantia.cliente, "cedula": garantia.cedula, "telefono": garantia.telefono, "email": garantia.email, "tipo_producto": garantia.tipo_producto, "marca": garantia.marca, "modelo": garantia.modelo, "serial": garantia.serial, "factura": garantia.factura, "fecha_compra": garantia.fecha_compra, "descripcion_falla": garantia.descripcion_falla, "imagen_path": garantia.imagen_path, "usuario_asignado": garantia.usuario_asignado, "estado": garantia.estado, "fecha_registro": garantia.fecha_registro.isoformat()}
+    return garantia_dict(garantia)
 
 @app.get("/api/garantias")
-def listar_garantias_api(db: Session = Depends(get_db), token: str = Header(None)):
+def listar_garantias_api(activas: bool = False, archivadas: bool = False, db: Session = Depends(get_db), token: str = Header(None)):
     username = verify_token(token)
     
     # Todos los usuarios pueden ver todas las garantías
     # Las restricciones de modificación se aplican en otros endpoints
-    items = db.query(Garantia).order_by(Garantia.id.desc()).all()
-    
-    out = []
-    for g in items:
-        out.append({"id": g.id, "cliente": g.cliente, "cedula": g.cedula, "telefono": g.telefono, "email": g.email, "tipo_producto": g.tipo_producto, "marca": g.marca, "modelo": g.modelo, "serial": g.serial, "factura": g.factura, "fecha_compra": g.fecha_compra, "descripcion_falla": g.descripcion_falla, "imagen_path": g.imagen_path, "usuario_asignado": g.usuario_asignado, "estado": g.estado, "fecha_registro": g.fecha_registro.isoformat()})
-    return out
+    if archivadas:
+        items = db.query(GarantiaArchivada).order_by(GarantiaArchivada.id.desc()).all()
+    else:
+        q = db.query(Garantia)
+        if activas:
+            q = q.filter(Garantia.estado.notin_(ESTADOS_CERRADOS))
+        items = q.order_by(Garantia.id.desc()).all()
+    
+    return [garantia_dict(g) for g in items]
+
+# CLIENTES
+# Autocompletar por prefijo de cédula o nombre (consulta por rango sobre índices)
+@app.get("/api/clientes/sugerir")
+def sugerir_clientes(prefix: str, token: str = Header(None), db: Session = Depends(get_db)):
+    verify_token(token)
+    if len(prefix.strip()) < 2:
+        return []
+    return [clientes.cliente_dict(c) for c in clientes.sugerir(db, prefix)]
+
+# Crear/fusionar clientes a partir de las garantías existentes (admin), en segundo plano
+@app.post("/api/clientes/vincular", status_code=202)
+def vincular_clientes(token: str = Header(None), db: Session = Depends(get_db)):
+    user = verify_token(token)
+    u = db.query(Usuario).filter(Usuario.username == user).first()
+    if not u or u.rol != "admin":
+        raise HTTPException(status_code=403, detail="Solo admin puede vincular clientes")
+    return trabajos.trabajo_dict(trabajos.encolar(db, "vincular_clientes", usuario=user))
+
+# REPORTES
+@app.get("/api/reportes/reincidencias")
+def reporte_reincidencias(limite: int = 20, token: str = Header(None), db: Session = Depends(get_db)):
+    verify_token(token)
+    return reincidencias.reporte(db, limite=limite)
+
+@app.post("/api/reportes/reincidencias/recalcular", status_code=202)
+def recalcular_reincidencias(token: str = Header(None), db: Session = Depends(get_db)):
+    user = verify_token(token)
+    u = db.query(Usuario).filter(Usuario.username == user).first()
+    if not u or u.rol != "admin":
+        raise HTTPException(status_code=403, detail="Solo admin puede recalcular reportes")
+    return trabajos.trabajo_dict(trabajos.encolar(db, "reincidencias", usuario=user))
+
+# Cola de trabajo del técnico: sus garantías abiertas (usa ix_garantias_asignado_estado_fecha)
+@app.get("/api/mis-garantias")
+def mis_garantias(orden: str = "antiguedad", token: str = Header(None), db: Session = Depends(get_db)):
+    username = verify_token(token)
+    if orden not in ("antiguedad", "prioridad"):
+        raise HTTPException(status_code=400, detail="Orden inválido (antiguedad o prioridad)")
+    q = db.query(Garantia).filter(Garantia.usuario_asignado == username, Garantia.estado.notin_(ESTADOS_CERRADOS))
+    if orden == "prioridad":
+        q = q.order_by(Garantia.prioridad.desc(), Garantia.fecha_registro.asc())
+    else:
+        q = q.order_by(Garantia.fecha_registro.asc())
+    return [garantia_dict(g) for g in q.all()]
 
 # comentarios con adjunto
 @app.post("/api/garantias/{gid}/comentarios")
-async def agregar_comentario(gid: int, texto: str = Form(...), archivo: Optional[UploadFile] = File(None), token: str = Header(None), db: Session = Depends(get_db)):
+async def agregar_comentario(gid: int, texto: str = Form(...), archivo: Optional[UploadFile] = File(None), token: str = Header(None), idempotency_key: Optional[str] = Header(None), db: Session = Depends(get_db)):
     user = verify_token(token)
+    previa = idempotencia.respuesta_previa(db, idempotency_key, user, f"POST /api/garantias/{gid}/comentarios")
+    if previa is not None:
+        return previa
+    db.info["usuario"] = user
     garantia = db.query(Garantia).filter(Garantia.id == gid).first()
     if not garantia:
         raise HTTPException(status_code=404, detail="Garantía no encontrada")
@@ -392,19 +579,28 @@ async def agregar_comentario(gid: int, texto: str = Form(...), archivo: Optional
         attachment_path = f"/uploads/{filename}"
     nuevo = Comentario(garantia_id=gid, usuario=user, texto=texto, attachment_path=attachment_path)
     db.add(nuevo)
-    db.commit()
-    db.refresh(nuevo)
-    return {"mensaje": "Comentario agregado", "comentario": {"usuario": nuevo.usuario, "texto": nuevo.texto, "attachment_path": nuevo.attachment_path, "fecha": nuevo.fecha.isoformat()}}
+    db.flush()
+    respuesta = {"mensaje": "Comentario agregado", "comentario": {"usuario": nuevo.usuario, "texto": nuevo.texto, "attachment_path": nuevo.attachment_path, "fecha": nuevo.fecha.isoformat()}}
+    return idempotencia.confirmar(db, idempotency_key, user, f"POST /api/garantias/{gid}/comentarios", respuesta)
+
+# Historial de cambios de la garantía y sus comentarios (más recientes primero)
+@app.get("/api/garantias/{gid}/historial")
+def historial_garantia(gid: int, limite: int = 100, antes_de: Optional[int] = None, token: str = Header(None), db: Session = Depends(get_db)):
+    verify_token(token)
+    return [cambios.cambio_dict(c) for c in cambios.historial(db, gid, limite=min(max(limite, 1), 500), antes_de=antes_de)]
 
 @app.get("/api/garantias/{gid}/comentarios")
 def listar_comentarios(gid: int, token: str = Header(None), db: Session = Depends(get_db)):
     verify_token(token)
-    comentarios = db.query(Comentario).filter(Comentario.garantia_id == gid).order_by(Comentario.id.asc()).all()
+    comentarios = comentarios_de(db, gid)
     return [{"usuario": c.usuario, "texto": c.texto, "attachment_path": c.attachment_path, "fecha": c.fecha.isoformat()} for c in comentarios]
 
 @app.patch("/api/garantias/{gid}/estado")
-def cambiar_estado(gid: int, estado: str = Form(...), token: str = Header(None), db: Session = Depends(get_db)):
+def cambiar_estado(gid: int, estado: str = Form(...), token: str = Header(None), idempotency_key: Optional[str] = Header(None), db: Session = Depends(get_db)):
     user = verify_token(token)
+    previa = idempotencia.respuesta_previa(db, idempotency_key, user, f"PATCH /api/garantias/{gid}/estado")
+    if previa is not None:
+        return previa
     u = db.query(Usuario).filter(Usuario.username == user).first()
     if not u:
         raise HTTPException(status_code=401, detail="Usuario inválido")
@@ -420,28 +616,58 @@ def cambiar_estado(gid: int, estado: str = Form(...), token: str = Header(None),
     # Si es técnico, solo puede cambiar sus propias garantías
     if u.rol == "tecnico" and garantia.usuario_asignado != user:
         raise HTTPException(status_code=403, detail="Solo puede cambiar estado de sus propias garantías")
+    db.info["usuario"] = user
     
+    carga.cambio_estado(db, garantia.usuario_asignado, garantia.estado, estado)
+    if garantia.estado != estado:
+        notificaciones.encolar(db, garantia, estado, usuario=user)
+        # El plazo de archivo se cuenta desde el cierre; reabrir la garantía lo reinicia
+        garantia.fecha_cierre = None if carga.esta_abierta(estado) else now_colombia()
     garantia.estado = estado
-    db.commit()
-    return {"mensaje": "Estado actualizado", "estado": garantia.estado}
+    return idempotencia.confirmar(db, idempotency_key, user, f"PATCH /api/garantias/{gid}/estado", {"mensaje": "Estado actualizado", "estado": estado})
 
-# export to excel (admin only)
-@app.get("/api/garantias/export")
+# export to excel (admin only): se genera en segundo plano, ver /api/jobs/{id}
+@app.post("/api/garantias/export", status_code=202)
 def export_garantias(token: str = Header(None), db: Session = Depends(get_db)):
     user = verify_token(token)
     u = db.query(Usuario).filter(Usuario.username == user).first()
     if not u or u.rol != "admin":
         raise HTTPException(status_code=403, detail="Solo admin puede exportar")
-    import pandas as pd
-    items = db.query(Garantia).order_by(Garantia.id.desc()).all()
-    rows = []
-    for g in items:
-        rows.append({"id": g.id, "cliente": g.cliente, "cedula": g.cedula, "telefono": g.telefono, "email": g.email, "tipo_producto": g.tipo_producto, "marca": g.marca, "modelo": g.modelo, "serial": g.serial, "factura": g.factura, "fecha_compra": g.fecha_compra, "descripcion_falla": g.descripcion_falla, "estado": g.estado, "fecha_registro": g.fecha_registro.isoformat()})
-    df = pd.DataFrame(rows)
-    out_path = os.path.join("data", f"garantias_export_{now_colombia().strftime('%Y%m%d%H%M%S')}.xlsx")
-    df.to_excel(out_path, index=False)
-    return FileResponse(out_path, filename=os.path.basename(out_path), media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    trabajo = trabajos.encolar(db, "exportar_garantias", usuario=user)
+    return trabajos.trabajo_dict(trabajo)
 
+# Impresión masiva de recibos: un PDF con un recibo por página, generado en segundo plano
+@app.post("/api/garantias/recibos", status_code=202)
+def imprimir_recibos(data: RecibosIn, token: str = Header(None), db: Session = Depends(get_db)):
+    user = verify_token(token)
+    if not data.ids:
+        raise HTTPException(status_code=400, detail="Indique al menos una garantía")
+    trabajo = trabajos.encolar(db, "recibos", {"ids": data.ids, "usuario": user}, usuario=user)
+    return trabajos.trabajo_dict(trabajo)
+
+# TRABAJOS EN SEGUNDO PLANO
+def obtener_trabajo(job_id, user, db):
+    trabajo = db.query(Trabajo).filter(Trabajo.id == job_id).first()
+    if not trabajo:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    if trabajo.usuario != user:
+        u = db.query(Usuario).filter(Usuario.username == user).first()
+        if not u or u.rol != "admin":
+            raise HTTPException(status_code=403, detail="No tiene permiso para ver este trabajo")
+    return trabajo
+
+@app.get("/api/jobs/{job_id}")
+def estado_trabajo(job_id: str, token: str = Header(None), db: Session = Depends(get_db)):
+    user = verify_token(token)
+    return trabajos.trabajo_dict(obtener_trabajo(job_id, user, db))
+
+@app.get("/api/jobs/{job_id}/resultado")
+def resultado_trabajo(job_id: str, token: str = Header(None), db: Session = Depends(get_db)):
+    user = verify_token(token)
+    trabajo = obtener_trabajo(job_id, user, db)
+    if trabajo.estado != "completado" or not trabajo.resultado_path or not os.path.isfile(trabajo.resultado_path):
+        raise HTTPException(status_code=409, detail="El trabajo no tiene resultado disponible")
+    return FileResponse(trabajo.resultado_path, filename=trabajo.resultado_nombre)
 
 # REASIGNAR USUARIO
 @app.put("/api/garantias/{gid}/asignar")
@@ -465,7 +691,9 @@ def reasignar_usuario(gid: int, usuario_asignado: str = Form(...), token: str =
         raise HTTPException(status_code=403, detail="No tiene permiso para reasignar garantías")
     if dbuser.rol == "tecnico" and garantia.usuario_asignado != username:
         raise HTTPException(status_code=403, detail="Solo puede reasignar garantías que estén asignadas a usted")
+    db.info["usuario"] = username
 
+    carga.reasignacion(db, garantia, garantia.usuario_asignado, usuario_asignado)
     garantia.usuario_asignado = usuario_asignado
     db.commit()
     return {"mensaje": "Usuario asignado exitosamente", "usuario_asignado": usuario_asignado}
@@ -475,7 +703,7 @@ def reasignar_usuario(gid: int, usuario_asignado: str = Form(...), token: str =
 def generar_recibo(gid: int, token: str = Header(None), db: Session = Depends(get_db)):
     username = verify_token(token)
     
-    garantia = db.query(Garantia).filter(Garantia.id == gid).first()
+    garantia = obtener_garantia(db, gid)
     if not garantia:
         raise HTTPException(status_code=404, detail="Garantía no encontrada")
     
@@ -487,225 +715,9 @@ def generar_recibo(gid: int, token: str = Header(None), db: Session = Depends(ge
     # Obtener usuario que generó la garantía (del primer comentario o del registro)
     usuario_registro = username  # Por defecto el usuario actual
     
-    # Generar PDF del recibo
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-    from reportlab.lib import colors
-    from reportlab.lib.units import inch
-    from io import BytesIO
-    
-    # Tamaño media carta (8.5 x 5.5 pulgadas)
-    half_letter = (8.5*inch, 5.5*inch)
-    
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(
-        buffer, 
-        pagesize=half_letter,
-        topMargin=0.1*inch,  # Margen superior más mínimo
-        bottomMargin=0.1*inch,
-        leftMargin=0.5*inch,
-        rightMargin=0.5*inch
-    )
-    styles = getSampleStyleSheet()
-    
-    # Estilos personalizados
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=10,
-        spaceAfter=3,
-        alignment=1  # Centrado
-    )
-    
-    subtitle_style = ParagraphStyle(
-        'CustomSubtitle',
-        parent=styles['Heading2'],
-        fontSize=14,
-        spaceAfter=20,
-        alignment=1
-    )
-    
-    small_style = ParagraphStyle(
-        'SmallText',
-        parent=styles['Normal'],
-        fontSize=9, # Aumentado de 6 a 8
-        spaceAfter=0,
-        leading=11,  # Aumentado para mejorar el interlineado
-        alignment=0  # Alinear a la izquierda para el texto de la empresa
-    )
-    
-    normal_style = styles['Normal']
-    normal_style.spaceAfter = 10
-    
-    # Estilo para política de garantía: letra muy pequeña, justificado
-    policy_style = ParagraphStyle(
-        'PolicyText',
-        parent=styles['Normal'],
-        fontSize=5,
-        leading=6,
-        alignment=4,  # 4 = JUSTIFY en ReportLab
-        spaceBefore=4,
-        spaceAfter=4,
-        leftIndent=0,
-        rightIndent=0,
-    )
-    
-    # Contenido del PDF
-    content = []
-    
-    # Header con logo y datos de empresa lado a lado
-    logo_cell = []
-    company_info_paragraph = []
-    
-    if config.logo_path and config.logo_path is not None:
-        try:
-            logo_path = os.path.join(os.getcwd(), config.logo_path.lstrip('/'))
-            if os.path.exists(logo_path):
-                logo = Image(logo_path, width=1*inch, height=1*inch)
-                logo_cell.append(logo)
-        except Exception as e:
-            pass  # Ignorar error si no se puede cargar logo
-
-    company_info_text = []
-    if config.nombre_empresa:
-        company_info_text.append(config.nombre_empresa)
-    if config.telefono:
-        company_info_text.append(f"Tel: {config.telefono}")
-    if config.email:
-        company_info_text.append(config.email)
-    if config.direccion:
-        company_info_text.append(config.direccion)
-    if config.ciudad:
-        company_info_text.append(config.ciudad)
-    if config.nit:
-        company_info_text.append(f"NIT: {config.nit}")
-    
-    if company_info_text:
-        company_info_paragraph = [Paragraph("<br/>".join(company_info_text), small_style)]
-    
-    # Solo crear tabla de header si hay algo que mostrar
-    if logo_cell or company_info_paragraph:
-        # Ancho total disponible para contenido (half_letter ancho - leftMargin - rightMargin)
-        available_width = half_letter[0] - (doc.leftMargin + doc.rightMargin)
-        
-        # Calcular anchos de columna para la tabla del encabezado
-        # Una columna para el logo, otra para la información de la empresa
-        logo_width = 1.0 * inch 
-        info_width = available_width - logo_width - 0.1*inch
-        
-        # Asegurar que logo_cell y company_info_paragraph estén listos para la tabla
-        logo_cell_for_table = logo_cell if logo_cell else []
-        info_cell_for_table = company_info_paragraph if company_info_paragraph else [Paragraph("", small_style)]
-        
-        header_table_data = [[logo_cell_for_table, info_cell_for_table]]
-        
-        header_table = Table(header_table_data, colWidths=[logo_width, info_width], hAlign='LEFT')
-        header_table.setStyle(TableStyle([
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('TOPPADDING', (1, 0), (1, 0), 0.1*inch),
-            ('LEFTPADDING', (0, 0), (-1, -1), 0),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 0),
-            ('TOPPADDING', (0, 0), (0, -1), 0),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 0),
-            ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-            ('ALIGN', (1, 0), (1, -1), 'LEFT'),
-        ]))
-        content.append(header_table)
-        content.append(Spacer(1, 2))
-    
-    # Título
-    content.append(Spacer(1, 8))
-    content.append(Paragraph(f"RECIBO DE GARANTÍA #{garantia.id}", title_style))
-    content.append(Spacer(1, 3))
-    
-    # Información básica en tabla
-    data = []
-    
-    # Agregar filas de datos
-    data.append(["Fecha y Hora:", garantia.fecha_registro.strftime('%d/%m/%Y %H:%M:%S')])
-    if garantia.fecha_compra:
-        data.append(["Fecha Compra:", garantia.fecha_compra])
-    data.append(["Cliente:", garantia.cliente])
-    if garantia.telefono:
-        data.append(["Teléfono:", garantia.telefono])
-    if garantia.email:
-        data.append(["Email:", garantia.email])
-
-    # Combinar producto en una sola línea
-    producto_parts = []
-    if garantia.tipo_producto:
-        producto_parts.append(garantia.tipo_producto)
-    if garantia.marca:
-        producto_parts.append(garantia.marca)
-    if garantia.modelo:
-        producto_parts.append(garantia.modelo)
-    producto_desc = " ".join(producto_parts)
-    if producto_desc:
-        data.append(["Producto:", producto_desc])
-    
-    if garantia.serial:
-        data.append(["Serial:", garantia.serial])
-    if garantia.factura:
-        data.append(["Factura:", garantia.factura])
-    data.append(["Usuario:", usuario_registro])
-    if garantia.descripcion_falla:
-        data.append(["Fallo:", garantia.descripcion_falla])
-    data.append(["Estado:", garantia.estado])
-    
-    # Crear tabla
-    table = Table(data, colWidths=[1.5*inch, 3.5*inch])  # Reducido para media carta
-    
-    # Construir estilos dinámicamente basado en el número real de filas
-    table_styles = [
-        ('BACKGROUND', (0, 0), (-1, -1), colors.white),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 8),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 3),
-        ('TOPPADDING', (0, 0), (-1, -1), 3),
-        ('LEFTPADDING', (0, 0), (-1, -1), 3),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 3),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.lightgrey),
-    ]
-    
-    # Agregar fondos alternos solo para filas que existen
-    num_rows = len(data)
-    for i in range(1, num_rows, 2):  # Filas impares con fondo gris
-        table_styles.append(('BACKGROUND', (0, i), (-1, i), colors.whitesmoke))
-    
-    table.setStyle(TableStyle(table_styles))
-    
-    content.append(table)
-    content.append(Spacer(1, 6))
-    
-    # Política de garantía (texto justificado, letra muy pequeña)
-    politica_texto = (
-        "EL PRESENTE DOCUMENTO NO SIGNIFICA QUE ACEPTAMOS LA GARANTÍA; SIGNIFICA QUE ESTAMOS RECIBIENDO EL EQUIPO "
-        "PARA REVISARLO Y CONFIRMAR SI APLICA O NO DICHA GARANTÍA. Después de 30 días a partir de la fecha, se cobrará "
-        "bodegaje a razón de quinientos pesos ($500) por día. Transcurridos 90 días, se considera que el dispositivo ha "
-        "sido abandonado. En caso de pérdida o daño por fuerza mayor no se responderá por el mismo."
-    )
-    content.append(Paragraph(politica_texto, policy_style))
-    content.append(Spacer(1, 4))
-    
-    # Firma
-    content.append(Paragraph("______________________________", ParagraphStyle('Firma', parent=normal_style, alignment=1)))
-    content.append(Paragraph("Firma del cliente", ParagraphStyle('FirmaLabel', parent=normal_style, alignment=1, spaceAfter=10)))
-    
-    # Generar PDF
-    doc.build(content)
-    buffer.seek(0)
-    
-    # Guardar en archivo temporal
-    import tempfile
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-        tmp_file.write(buffer.getvalue())
-        tmp_path = tmp_file.name
-    
-    return FileResponse(
-        tmp_path, 
+    pdf = generar_pdf_recibos([garantia], config, usuario_registro)
+    return Response(
+        content=pdf,
         media_type='application/pdf',
-        filename=f'recibo_garantia_{garantia.id}.pdf'
+        headers={"Content-Disposition": f'attachment; filename="recibo_garantia_{garantia.id}.pdf"'}
     )
@@ -0,0 +1,283 @@
+"""
+Herramienta de mantenimiento de la base de datos y de uploads/.
+
+Subcomandos:
+  purgar      Borra garantías (y sus comentarios, notificaciones, historial y archivos) según filtros:
+              --desde/--hasta (fecha de registro, YYYY-MM-DD), --estado, --solo-prueba o --todas.
+              Borra por lotes, cada lote en una transacción, y luego limpia huérfanos y compacta la BD.
+  huerfanos   Borra comentarios sin garantía, clientes sin garantías (activas ni archivadas)
+              y archivos de uploads/ que ninguna fila referencia.
+  compactar   VACUUM incremental + ANALYZE.
+  historial   Borra los cambios más antiguos que --dias-retencion y fusiona las ediciones
+              seguidas del mismo usuario y día más antiguas que --dias-compactar.
+  claves      Borra las claves de idempotencia (Idempotency-Key) más antiguas que --dias.
+
+Todos aceptan --dry-run: solo informa cuántas filas/archivos se borrarían y cuántos bytes se liberarían.
+Nunca se borran usuarios, configuración de empresa ni el logo.
+
+Cómo ejecutar:
+
+  Si usas Docker:
+    docker exec -it garantias_app_v3_4 python mantenimiento.py purgar --solo-prueba --dry-run
+
+  Si corres la app localmente desde la carpeta app/:
+    python mantenimiento.py purgar --hasta 2024-01-01 --estado Rechazada
+    python mantenimiento.py huerfanos
+    python mantenimiento.py compactar
+    python mantenimiento.py historial --dias-retencion 365
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta
+
+# Ir a la carpeta app para que la BD (./data/garantias.db) y uploads coincidan con la app
+app_dir = os.path.dirname(os.path.abspath(__file__))
+if os.getcwd() != app_dir:
+    os.chdir(app_dir)
+sys.path.insert(0, app_dir)
+
+from sqlalchemy import text, or_
+from database import SessionLocal, engine
+from migraciones import aplicar_migraciones
+from models import Garantia, Comentario, GarantiaArchivada, ComentarioArchivado, Cliente, ConfiguracionEmpresa, Notificacion, Cambio
+from archivo import UPLOAD_DIR, ARCHIVO_UPLOAD_DIR, ARCHIVO_URL
+from carga import recalcular_carga
+from reincidencias import recalcular_reincidencias
+from cambios import compactar_cambios, purgar_cambios, DIAS_COMPACTAR, DIAS_RETENCION
+import idempotencia
+
+LOTE = 500
+# Archivos más recientes que esto no se consideran huérfanos (pueden estar subiéndose ahora mismo)
+EDAD_MINIMA_HUERFANO = timedelta(hours=1)
+
+# (modelo de garantía, modelo de comentario) de las tablas activas y del archivo
+TABLAS = [(Garantia, Comentario), (GarantiaArchivada, ComentarioArchivado)]
+
+def ruta_en_disco(path):
+    """Convierte una ruta pública (/uploads/x, /uploads-archivo/x) en la ruta del archivo en disco."""
+    if not path:
+        return None
+    nombre = os.path.basename(path)
+    if path.startswith("/uploads/"):
+        return os.path.join(UPLOAD_DIR, nombre)
+    if path.startswith(ARCHIVO_URL):
+        gz = os.path.join(ARCHIVO_UPLOAD_DIR, nombre + ".gz")
+        return gz if os.path.isfile(gz) else os.path.join(ARCHIVO_UPLOAD_DIR, nombre)
+    return None
+
+def _tamano(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def _borrar_archivos(paths, dry_run):
+    n, liberados = 0, 0
+    for path in paths:
+        if not path or not os.path.isfile(path):
+            continue
+        size = _tamano(path)
+        if not dry_run:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"  No se pudo borrar {path}: {e}")
+                continue
+        n += 1
+        liberados += size
+    return n, liberados
+
+def filtros_garantia(modelo, desde=None, hasta=None, estados=None, solo_prueba=False):
+    filtros = []
+    if desde:
+        filtros.append(modelo.fecha_registro >= desde)
+    if hasta:
+        filtros.append(modelo.fecha_registro < hasta)
+    if estados:
+        filtros.append(modelo.estado.in_(estados))
+    if solo_prueba:
+        filtros.append(modelo.es_prueba == True)  # noqa: E712
+    return filtros
+
+def purgar(db, filtros_por_modelo, lote=LOTE, dry_run=False):
+    """Borra por lotes las garantías que cumplen los filtros, sus comentarios y los archivos que referencian."""
+    total = {"garantias": 0, "comentarios": 0, "archivos": 0, "bytes": 0}
+    for modelo_g, modelo_c in TABLAS:
+        filtros = filtros_por_modelo(modelo_g)
+        ultimo_id = 0
+        while True:
+            # En dry-run no se borra nada, así que se avanza por id para no repetir el mismo lote
+            filas = db.query(modelo_g.id, modelo_g.imagen_path).filter(*filtros, modelo_g.id > ultimo_id).order_by(modelo_g.id).limit(lote).all()
+            if not filas:
+                break
+            ids = [f[0] for f in filas]
+            ultimo_id = ids[-1]
+            paths = [f[1] for f in filas]
+            comentarios = db.query(modelo_c.attachment_path).filter(modelo_c.garantia_id.in_(ids)).all()
+            paths.extend(c[0] for c in comentarios)
+            if not dry_run:
+                try:
+                    # Primero los comentarios (hijos) y luego las garantías, en la misma transacción
+                    db.query(modelo_c).filter(modelo_c.garantia_id.in_(ids)).delete(synchronize_session=False)
+                    db.query(Notificacion).filter(Notificacion.garantia_id.in_(ids)).delete(synchronize_session=False)
+                    db.query(Cambio).filter(Cambio.garantia_id.in_(ids)).delete(synchronize_session=False)
+                    db.query(modelo_g).filter(modelo_g.id.in_(ids)).delete(synchronize_session=False)
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    raise
+            # Los archivos se borran solo después de confirmar la transacción
+            n, liberados = _borrar_archivos([ruta_en_disco(p) for p in paths], dry_run)
+            total["garantias"] += len(ids)
+            total["comentarios"] += len(comentarios)
+            total["archivos"] += n
+            total["bytes"] += liberados
+    return total
+
+def limpiar_huerfanos(db, dry_run=False, filtros_por_modelo=None):
+    """Borra comentarios cuya garantía ya no existe, clientes sin garantías (activas ni archivadas)
+    y archivos de uploads/ que nadie referencia. En el dry-run de una purga, `filtros_por_modelo`
+    indica las garantías que se habrían borrado, para contar los clientes que quedarían sin ninguna."""
+    total = {"comentarios": 0, "clientes": 0, "archivos": 0, "bytes": 0}
+    for modelo_g, modelo_c in TABLAS:
+        huerfanos = db.query(modelo_c).filter(or_(modelo_c.garantia_id.is_(None), ~modelo_c.garantia_id.in_(db.query(modelo_g.id))))
+        total["comentarios"] += huerfanos.count()
+        if not dry_run:
+            huerfanos.delete(synchronize_session=False)
+            db.commit()
+
+    condiciones = []
+    for modelo_g, _ in TABLAS:
+        con_cliente = db.query(modelo_g.cliente_id).filter(modelo_g.cliente_id.isnot(None))
+        if dry_run and filtros_por_modelo:
+            con_cliente = con_cliente.filter(modelo_g.id.notin_(db.query(modelo_g.id).filter(*filtros_por_modelo(modelo_g))))
+        condiciones.append(~Cliente.id.in_(con_cliente))
+    sin_garantias = db.query(Cliente).filter(*condiciones)
+    total["clientes"] = sin_garantias.count()
+    if not dry_run and total["clientes"]:
+        sin_garantias.delete(synchronize_session=False)
+        db.commit()
+
+    referenciados = set()
+    for modelo_g, modelo_c in TABLAS:
+        referenciados.update(ruta_en_disco(r[0]) for r in db.query(modelo_g.imagen_path).filter(modelo_g.imagen_path.isnot(None)))
+        referenciados.update(ruta_en_disco(r[0]) for r in db.query(modelo_c.attachment_path).filter(modelo_c.attachment_path.isnot(None)))
+    config = db.query(ConfiguracionEmpresa).first()
+    if config and config.logo_path:
+        referenciados.add(ruta_en_disco(config.logo_path))
+
+    limite = time.time() - EDAD_MINIMA_HUERFANO.total_seconds()
+    candidatos = []
+    for carpeta in (UPLOAD_DIR, ARCHIVO_UPLOAD_DIR):
+        if not os.path.isdir(carpeta):
+            continue
+        with os.scandir(carpeta) as it:
+            for entry in it:
+                if entry.is_file() and entry.path not in referenciados and entry.stat().st_mtime < limite:
+                    candidatos.append(entry.path)
+    total["archivos"], total["bytes"] = _borrar_archivos(candidatos, dry_run)
+    return total
+
+def _db_path():
+    return os.path.abspath(engine.url.database)
+
+def compactar(dry_run=False):
+    """VACUUM incremental + ANALYZE. La primera vez activa auto_vacuum=INCREMENTAL, lo que requiere un VACUUM completo."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        page_size = conn.execute(text("PRAGMA page_size")).scalar()
+        libres = conn.execute(text("PRAGMA freelist_count")).scalar()
+        if dry_run:
+            return {"bytes": page_size * libres}
+        antes = _tamano(_db_path())
+        if conn.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+            conn.execute(text("PRAGMA auto_vacuum=INCREMENTAL"))
+            conn.execute(text("VACUUM"))
+        else:
+            conn.execute(text("PRAGMA incremental_vacuum"))
+        conn.execute(text("ANALYZE"))
+    return {"bytes": max(antes - _tamano(_db_path()), 0)}
+
+def _fecha(valor):
+    return datetime.strptime(valor, "%Y-%m-%d")
+
+def _mb(n):
+    return f"{n / (1024 * 1024):.2f} MB"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mantenimiento de garantías y uploads")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_purgar = sub.add_parser("purgar", help="Borrar garantías según filtros")
+    p_purgar.add_argument("--desde", type=_fecha, help="Fecha de registro desde (YYYY-MM-DD, inclusive)")
+    p_purgar.add_argument("--hasta", type=_fecha, help="Fecha de registro hasta (YYYY-MM-DD, exclusive)")
+    p_purgar.add_argument("--estado", action="append", help="Estado a borrar (se puede repetir)")
+    p_purgar.add_argument("--solo-prueba", action="store_true", help="Solo garantías marcadas como de prueba")
+    p_purgar.add_argument("--todas", action="store_true", help="Borrar TODAS las garantías")
+    p_purgar.add_argument("--lote", type=int, default=LOTE, help=f"Garantías por transacción (por defecto {LOTE})")
+    p_purgar.add_argument("--dry-run", action="store_true", help="Solo informar, no borrar nada")
+
+    p_huerfanos = sub.add_parser("huerfanos", help="Borrar comentarios, clientes y archivos huérfanos")
+    p_huerfanos.add_argument("--dry-run", action="store_true", help="Solo informar, no borrar nada")
+
+    p_compactar = sub.add_parser("compactar", help="VACUUM incremental + ANALYZE")
+    p_compactar.add_argument("--dry-run", action="store_true", help="Solo informar el espacio libre en la BD")
+
+    p_historial = sub.add_parser("historial", help="Retención y compactación del historial de cambios")
+    p_historial.add_argument("--dias-retencion", type=int, default=DIAS_RETENCION, help=f"Borrar cambios con más de estos días (por defecto {DIAS_RETENCION})")
+    p_historial.add_argument("--dias-compactar", type=int, default=DIAS_COMPACTAR, help=f"Compactar cambios con más de estos días (por defecto {DIAS_COMPACTAR})")
+    p_historial.add_argument("--dry-run", action="store_true", help="Solo informar, no borrar nada")
+
+    p_claves = sub.add_parser("claves", help="Borrar claves de idempotencia antiguas")
+    p_claves.add_argument("--dias", type=int, default=idempotencia.DIAS_RETENCION, help=f"Borrar claves con más de estos días (por defecto {idempotencia.DIAS_RETENCION})")
+    p_claves.add_argument("--dry-run", action="store_true", help="Solo informar, no borrar nada")
+
+    args = parser.parse_args(argv)
+    aplicar_migraciones()
+    db = SessionLocal()
+    try:
+        if args.comando == "purgar":
+            if not (args.todas or args.desde or args.hasta or args.estado or args.solo_prueba):
+                parser.error("purgar requiere al menos un filtro o --todas")
+            filtros = lambda modelo: filtros_garantia(modelo, args.desde, args.hasta, args.estado, args.solo_prueba)
+            total = purgar(db, filtros, lote=args.lote, dry_run=args.dry_run)
+            if not args.dry_run:
+                recalcular_carga(db)
+                recalcular_reincidencias(db)
+            huerfanos = limpiar_huerfanos(db, dry_run=args.dry_run, filtros_por_modelo=filtros)
+            bd = compactar(dry_run=args.dry_run)
+            print("Simulación (no se borró nada):" if args.dry_run else "Purga completada:")
+            print(f"  - Garantías borradas: {total['garantias']}")
+            print(f"  - Comentarios borrados: {total['comentarios'] + huerfanos['comentarios']}")
+            print(f"  - Clientes sin garantías borrados: {huerfanos['clientes']}")
+            print(f"  - Archivos borrados: {total['archivos'] + huerfanos['archivos']} ({_mb(total['bytes'] + huerfanos['bytes'])})")
+            print(f"  - Espacio recuperado en la BD: {_mb(bd['bytes'])}")
+            print("Usuarios, configuración de empresa y logo se mantienen.")
+        elif args.comando == "huerfanos":
+            total = limpiar_huerfanos(db, dry_run=args.dry_run)
+            print("Simulación (no se borró nada):" if args.dry_run else "Huérfanos eliminados:")
+            print(f"  - Comentarios sin garantía: {total['comentarios']}")
+            print(f"  - Clientes sin garantías: {total['clientes']}")
+            print(f"  - Archivos sin referencia: {total['archivos']} ({_mb(total['bytes'])})")
+        elif args.comando == "compactar":
+            bd = compactar(dry_run=args.dry_run)
+            print(f"Espacio {'recuperable' if args.dry_run else 'recuperado'} en la BD: {_mb(bd['bytes'])}")
+        elif args.comando == "historial":
+            borrados = purgar_cambios(db, dias=args.dias_retencion, dry_run=args.dry_run)
+            fusionados = compactar_cambios(db, dias=args.dias_compactar, dry_run=args.dry_run)
+            print("Simulación (no se borró nada):" if args.dry_run else "Historial compactado:")
+            print(f"  - Cambios de más de {args.dias_retencion} días borrados: {borrados}")
+            print(f"  - Cambios fusionados al compactar: {fusionados}")
+        elif args.comando == "claves":
+            n = idempotencia.purgar_claves(db, dias=args.dias, dry_run=args.dry_run)
+            print(f"Claves de idempotencia de más de {args.dias} días {'a borrar' if args.dry_run else 'borradas'}: {n}")
+    except Exception as e:
+        db.rollback()
+        print(f"Error: {e}")
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
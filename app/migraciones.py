@@ -0,0 +1,130 @@
+"""
+Creación de tablas y migraciones simples de esquema (SQLite).
+Lo usan tanto la app (main.py) como los scripts de mantenimiento, para que
+todos trabajen siempre sobre el mismo esquema.
+"""
+from sqlalchemy import text
+from sqlalchemy.schema import CreateTable, CreateIndex
+from database import engine, Base
+import models  # noqa: F401  (registra los modelos en Base.metadata)
+from models import ESTADOS_CERRADOS
+
+# (tabla, columna, DDL) que deben existir en bases creadas con versiones anteriores
+COLUMNAS = [
+    ("garantias", "email", "VARCHAR"),
+    ("garantias", "es_prueba", "BOOLEAN DEFAULT 0"),
+    ("garantias_archivo", "es_prueba", "BOOLEAN DEFAULT 0"),
+    ("garantias", "prioridad", "INTEGER DEFAULT 0"),
+    ("garantias_archivo", "prioridad", "INTEGER DEFAULT 0"),
+    ("garantias", "cliente_id", "INTEGER REFERENCES clientes(id)"),
+    ("garantias_archivo", "cliente_id", "INTEGER"),
+    ("garantias", "serial_norm", "VARCHAR"),
+    ("garantias", "factura_norm", "VARCHAR"),
+    ("garantias_archivo", "serial_norm", "VARCHAR"),
+    ("garantias_archivo", "factura_norm", "VARCHAR"),
+    ("garantias", "fecha_cierre", "DATETIME"),
+    ("garantias_archivo", "fecha_cierre", "DATETIME"),
+]
+
+def ensure_columns():
+    with engine.connect() as conn:
+        for tabla, columna, ddl in COLUMNAS:
+            try:
+                r = conn.execute(text(f"PRAGMA table_info({tabla})"))
+                cols = [row[1] for row in r.fetchall()]
+                if columna not in cols:
+                    conn.execute(text(f"ALTER TABLE {tabla} ADD COLUMN {columna} {ddl}"))
+                    conn.commit()
+            except Exception:
+                pass
+
+def ensure_fecha_cierre():
+    """Garantías cerradas antes de existir fecha_cierre: se toma el último cambio de estado del
+    historial; si no lo hay, el último comentario y, en último caso, la fecha de registro."""
+    cerrados = ", ".join(f"'{e}'" for e in ESTADOS_CERRADOS)
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            UPDATE garantias SET fecha_cierre = coalesce(
+                (SELECT max(fecha) FROM cambios WHERE cambios.garantia_id = garantias.id AND entidad = 'garantia'
+                    AND accion = 'editar' AND json_extract(cambios.cambios, '$.estado') IS NOT NULL),
+                (SELECT max(fecha) FROM comentarios WHERE comentarios.garantia_id = garantias.id),
+                fecha_registro)
+            WHERE fecha_cierre IS NULL AND estado IN ({cerrados})
+        """))
+
+# Índices reemplazados por otros compuestos
+INDICES_OBSOLETOS = [
+    "ix_garantias_usuario_asignado",  # cubierto por ix_garantias_asignado_estado_fecha
+]
+
+def ensure_indexes():
+    with engine.connect() as conn:
+        for nombre in INDICES_OBSOLETOS:
+            conn.execute(text(f"DROP INDEX IF EXISTS {nombre}"))
+        conn.commit()
+    # create_all no crea índices nuevos en tablas que ya existían
+    for tabla in Base.metadata.sorted_tables:
+        for indice in tabla.indexes:
+            indice.create(bind=engine, checkfirst=True)
+
+# (tabla activa, tabla de archivo): los ids nuevos no deben repetir los de ninguna de las dos
+TABLAS_ARCHIVADAS = [("garantias", "garantias_archivo"), ("comentarios", "comentarios_archivo")]
+
+def _reconstruir_con_autoincrement(tabla):
+    """Recrea la tabla con AUTOINCREMENT copiando sus filas (SQLite no permite agregarlo con ALTER)."""
+    t = Base.metadata.tables[tabla]
+    raw = engine.raw_connection()
+    con = raw.driver_connection
+    nivel = con.isolation_level
+    con.isolation_level = None  # BEGIN/COMMIT explícitos
+    try:
+        con.execute("PRAGMA foreign_keys=OFF")
+        # Sin esto, RENAME reescribe las FK de comentarios para apuntar a la tabla vieja
+        con.execute("PRAGMA legacy_alter_table=ON")
+        con.execute("BEGIN")
+        try:
+            viejas = [r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL", (tabla,))]
+            for nombre in viejas:
+                con.execute(f"DROP INDEX {nombre}")
+            con.execute(f"ALTER TABLE {tabla} RENAME TO {tabla}__viejo")
+            con.execute(str(CreateTable(t).compile(dialect=engine.dialect)))
+            for indice in t.indexes:
+                con.execute(str(CreateIndex(indice).compile(dialect=engine.dialect)))
+            existentes = {r[1] for r in con.execute(f"PRAGMA table_info({tabla}__viejo)")}
+            cols = ", ".join(c.name for c in t.columns if c.name in existentes)
+            con.execute(f"INSERT INTO {tabla} ({cols}) SELECT {cols} FROM {tabla}__viejo")
+            con.execute(f"DROP TABLE {tabla}__viejo")
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.execute("PRAGMA legacy_alter_table=OFF")
+            con.execute("PRAGMA foreign_keys=ON")
+    finally:
+        con.isolation_level = nivel
+        raw.close()
+
+def ensure_autoincrement():
+    """Bases creadas antes de AUTOINCREMENT: al archivar las garantías de id más alto, SQLite
+    volvía a entregar esos ids y se mezclaban comentarios e historial con los del archivo."""
+    for tabla, archivo in TABLAS_ARCHIVADAS:
+        with engine.connect() as conn:
+            ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type='table' AND name=:t"), {"t": tabla}).scalar() or ""
+        if "AUTOINCREMENT" not in ddl.upper():
+            _reconstruir_con_autoincrement(tabla)
+        # El contador arranca por encima del mayor id de la tabla activa y del archivo
+        with engine.begin() as conn:
+            maximo = conn.execute(text(f"SELECT max(coalesce((SELECT max(id) FROM {tabla}), 0), coalesce((SELECT max(id) FROM {archivo}), 0))")).scalar()
+            actual = conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name=:t"), {"t": tabla}).scalar()
+            if actual is None:
+                conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:t, :m)"), {"t": tabla, "m": maximo})
+            elif actual < maximo:
+                conn.execute(text("UPDATE sqlite_sequence SET seq=:m WHERE name=:t"), {"t": tabla, "m": maximo})
+
+def aplicar_migraciones():
+    Base.metadata.create_all(bind=engine)
+    ensure_columns()
+    ensure_fecha_cierre()
+    ensure_autoincrement()
+    ensure_indexes()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean, Index
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime, timezone, timedelta
@@ -10,11 +10,27 @@ def now_colombia():
     """Retorna la hora actual en zona horaria de Colombia (UTC-5)"""
     return datetime.now(COLOMBIA_TZ).replace(tzinfo=None)
 
+# Estados en los que la garantía se considera cerrada (archivables)
+ESTADOS_CERRADOS = ("Resuelta", "Rechazada", "Abandonada")
+
+# Cliente único por cédula (normalizada). Las garantías guardan además una copia de sus datos.
+class Cliente(Base):
+    __tablename__ = "clientes"
+    id = Column(Integer, primary_key=True, index=True)
+    cedula = Column(String, unique=True, index=True, nullable=False)
+    nombre = Column(String, nullable=False)
+    nombre_busqueda = Column(String, index=True, nullable=True)  # minúsculas sin tildes, para sugerir por nombre
+    telefono = Column(String, nullable=True)
+    email = Column(String, nullable=True)
+    fecha_creacion = Column(DateTime, default=now_colombia)
+    fecha_actualizacion = Column(DateTime, default=now_colombia, onupdate=now_colombia)
+
 class Garantia(Base):
     __tablename__ = "garantias"
     id = Column(Integer, primary_key=True, index=True)
     cliente = Column(String, index=True, nullable=False)
-    cedula = Column(String, nullable=True)
+    cedula = Column(String, nullable=True, index=True)
+    cliente_id = Column(Integer, ForeignKey("clientes.id"), nullable=True, index=True)
     telefono = Column(String, nullable=True)
     email = Column(String, nullable=True)
     tipo_producto = Column(String, nullable=True)
@@ -22,13 +38,24 @@ class Garantia(Base):
     modelo = Column(String, nullable=True)
     serial = Column(String, nullable=True)
     factura = Column(String, nullable=True)
+    serial_norm = Column(String, nullable=True, index=True)  # ver reincidencias.normalizar_codigo
+    factura_norm = Column(String, nullable=True, index=True)
     fecha_compra = Column(String, nullable=True)
     descripcion_falla = Column(Text, nullable=True)
     imagen_path = Column(String, nullable=True)
     estado = Column(String, default="Recibido")
-    usuario_asignado = Column(String, nullable=True, index=True)
+    usuario_asignado = Column(String, nullable=True)  # indexado por ix_garantias_asignado_estado_fecha
     fecha_registro = Column(DateTime, default=now_colombia)
+    es_prueba = Column(Boolean, default=False)  # registros de prueba, borrables con mantenimiento.py
+    prioridad = Column(Integer, default=0)  # 0 normal, 1 alta, 2 urgente
+    fecha_cierre = Column(DateTime, nullable=True)  # al pasar a ESTADOS_CERRADOS; base del plazo de archivo
     comentarios = relationship("Comentario", back_populates="garantia", cascade="all, delete-orphan")
+    __table_args__ = (
+        # Cola de trabajo por técnico (/api/mis-garantias)
+        Index("ix_garantias_asignado_estado_fecha", "usuario_asignado", "estado", "fecha_registro"),
+        # AUTOINCREMENT: los ids de garantías archivadas no se vuelven a usar (ver migraciones.py)
+        {"sqlite_autoincrement": True},
+    )
 
 class Comentario(Base):
     __tablename__ = "comentarios"
@@ -39,6 +66,7 @@ class Comentario(Base):
     attachment_path = Column(String, nullable=True)
     fecha = Column(DateTime, default=now_colombia)
     garantia = relationship("Garantia", back_populates="comentarios")
+    __table_args__ = {"sqlite_autoincrement": True}
 
 class Usuario(Base):
     __tablename__ = "usuarios"
@@ -48,6 +76,12 @@ class Usuario(Base):
     rol = Column(String, nullable=False, default="consulta")
     fecha_creacion = Column(DateTime, default=now_colombia)
 
+# Garantías abiertas por usuario, para la asignación automática sin hacer COUNT(*) en cada creación
+class CargaTecnico(Base):
+    __tablename__ = "carga_tecnicos"
+    username = Column(String, primary_key=True)
+    abiertas = Column(Integer, nullable=False, default=0)
+
 class ConfiguracionEmpresa(Base):
     __tablename__ = "configuracion_empresa"
     id = Column(Integer, primary_key=True, index=True)
@@ -59,3 +93,117 @@ class ConfiguracionEmpresa(Base):
     nit = Column(String, nullable=True)
     logo_path = Column(String, nullable=True)
     fecha_actualizacion = Column(DateTime, default=now_colombia, onupdate=now_colombia)
+
+# ARCHIVO: garantías cerradas y antiguas se mueven aquí para mantener pequeñas las tablas activas.
+# Conservan el mismo id que tenían en "garantias"/"comentarios".
+class GarantiaArchivada(Base):
+    __tablename__ = "garantias_archivo"
+    id = Column(Integer, primary_key=True, index=True)
+    cliente = Column(String, nullable=False)
+    cedula = Column(String, nullable=True, index=True)
+    cliente_id = Column(Integer, nullable=True, index=True)
+    telefono = Column(String, nullable=True)
+    email = Column(String, nullable=True)
+    tipo_producto = Column(String, nullable=True)
+    marca = Column(String, nullable=True)
+    modelo = Column(String, nullable=True)
+    serial = Column(String, nullable=True, index=True)
+    factura = Column(String, nullable=True)
+    serial_norm = Column(String, nullable=True, index=True)
+    factura_norm = Column(String, nullable=True, index=True)
+    fecha_compra = Column(String, nullable=True)
+    descripcion_falla = Column(Text, nullable=True)
+    imagen_path = Column(String, nullable=True)
+    estado = Column(String, nullable=True)
+    usuario_asignado = Column(String, nullable=True)
+    fecha_registro = Column(DateTime, nullable=True)
+    es_prueba = Column(Boolean, default=False)
+    prioridad = Column(Integer, default=0)
+    fecha_cierre = Column(DateTime, nullable=True)
+    fecha_archivo = Column(DateTime, default=now_colombia)
+
+class ComentarioArchivado(Base):
+    __tablename__ = "comentarios_archivo"
+    id = Column(Integer, primary_key=True)
+    garantia_id = Column(Integer, index=True)
+    usuario = Column(String, nullable=False)
+    texto = Column(Text, nullable=False)
+    attachment_path = Column(String, nullable=True)
+    fecha = Column(DateTime, nullable=True)
+
+# Reporte de reincidencias por modelo, actualizado de forma incremental al registrar garantías
+class ReincidenciaModelo(Base):
+    __tablename__ = "reincidencias_modelo"
+    marca = Column(String, primary_key=True)
+    modelo = Column(String, primary_key=True)
+    garantias = Column(Integer, nullable=False, default=0)
+    reincidencias = Column(Integer, nullable=False, default=0)  # garantías de un serial ya visto antes
+    fecha_actualizacion = Column(DateTime, default=now_colombia, onupdate=now_colombia)
+
+# TRABAJOS en segundo plano (exportaciones, recibos masivos...), procesados por trabajos.py
+class Trabajo(Base):
+    __tablename__ = "trabajos"
+    id = Column(String, primary_key=True)  # uuid hex
+    tipo = Column(String, nullable=False)
+    estado = Column(String, nullable=False, default="pendiente")  # pendiente, en_proceso, completado, error
+    progreso = Column(Integer, nullable=False, default=0)  # 0-100
+    parametros = Column(Text, nullable=True)  # JSON
+    usuario = Column(String, nullable=True)
+    intentos = Column(Integer, nullable=False, default=0)
+    max_intentos = Column(Integer, nullable=False, default=3)
+    disponible_desde = Column(DateTime, default=now_colombia)  # para reintentos con espera
+    resultado_path = Column(String, nullable=True)
+    resultado_nombre = Column(String, nullable=True)
+    error = Column(Text, nullable=True)
+    fecha_creacion = Column(DateTime, default=now_colombia)
+    fecha_actualizacion = Column(DateTime, default=now_colombia, onupdate=now_colombia)
+    __table_args__ = (
+        Index("ix_trabajos_estado_disponible", "estado", "disponible_desde"),
+    )
+
+# NOTIFICACIONES a clientes (outbox): se insertan en la misma transacción que el cambio de
+# estado y las envía por correo el despachador de notificaciones.py
+class Notificacion(Base):
+    __tablename__ = "notificaciones"
+    id = Column(Integer, primary_key=True)
+    garantia_id = Column(Integer, nullable=False, index=True)  # sin FK: la garantía puede archivarse antes del envío
+    evento = Column(String, nullable=False)  # "registro" o el estado nuevo
+    destinatario = Column(String, nullable=False)
+    usuario = Column(String, nullable=True)  # quien hizo el cambio (aparece en el recibo adjunto)
+    estado = Column(String, nullable=False, default="pendiente")  # pendiente, enviando, enviada, error
+    intentos = Column(Integer, nullable=False, default=0)
+    disponible_desde = Column(DateTime, default=now_colombia)  # para reintentos con espera
+    error = Column(Text, nullable=True)
+    fecha_creacion = Column(DateTime, default=now_colombia)
+    fecha_envio = Column(DateTime, nullable=True)
+    __table_args__ = (
+        Index("ix_notificaciones_estado_disponible", "estado", "disponible_desde"),
+    )
+
+# HISTORIAL de cambios (ver cambios.py): solo los campos que cambiaron, {"campo": [antes, después]}
+class Cambio(Base):
+    __tablename__ = "cambios"
+    id = Column(Integer, primary_key=True)
+    entidad = Column(String, nullable=False)  # garantia, comentario, configuracion
+    entidad_id = Column(Integer, nullable=True)
+    garantia_id = Column(Integer, nullable=True)  # indexado por ix_cambios_garantia; None en configuración
+    accion = Column(String, nullable=False)  # crear, editar, borrar
+    cambios = Column(Text, nullable=True)  # JSON compacto; None al crear o borrar
+    usuario = Column(String, nullable=True)
+    fecha = Column(DateTime, default=now_colombia)
+    compactado = Column(Boolean, nullable=False, default=False)
+    __table_args__ = (
+        # /api/garantias/{gid}/historial: los cambios de una garantía en orden, sin ordenar en memoria
+        Index("ix_cambios_garantia", "garantia_id", "id"),
+        Index("ix_cambios_fecha", "fecha"),
+    )
+
+# Claves de idempotencia (header Idempotency-Key): la respuesta de cada petición ya procesada,
+# para que un reintento (p. ej. la cola offline de la interfaz) no repita la operación
+class ClaveIdempotencia(Base):
+    __tablename__ = "claves_idempotencia"
+    clave = Column(String, primary_key=True)
+    usuario = Column(String, nullable=False)
+    ruta = Column(String, nullable=False)  # "POST /api/garantias", para detectar claves reutilizadas
+    respuesta = Column(Text, nullable=False)  # JSON
+    fecha = Column(DateTime, default=now_colombia, index=True)
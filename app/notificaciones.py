@@ -0,0 +1,241 @@
+"""
+Notificaciones por correo a los clientes (patrón outbox).
+
+- encolar() inserta la notificación en la tabla "notificaciones" dentro de la misma transacción
+  que el registro o el cambio de estado: si el cambio se revierte, no se avisa nada, y la
+  petición no espera al servidor de correo.
+- Un hilo despachador toma las pendientes por lotes, abre UNA conexión SMTP por lote, arma cada
+  correo con la plantilla de su evento (adjuntando el recibo PDF cuando corresponde) y respeta
+  un máximo de envíos por minuto. Los errores temporales se reintentan con espera creciente.
+
+Configuración (variables de entorno); sin SMTP_HOST las notificaciones están desactivadas:
+  SMTP_HOST, SMTP_PORT (25), SMTP_USER, SMTP_PASSWORD, SMTP_TLS (1 = STARTTLS),
+  SMTP_FROM, NOTIFICACIONES_POR_MINUTO (30), NOTIFICACIONES_LOTE (20)
+"""
+import os, time, smtplib, threading, traceback
+from datetime import timedelta
+from email.message import EmailMessage
+from email.utils import formataddr
+from sqlalchemy import update
+from database import SessionLocal
+from models import Notificacion, ConfiguracionEmpresa, now_colombia
+from archivo import obtener_garantia
+from recibos import generar_pdf_recibos
+
+SMTP_HOST = os.environ.get("SMTP_HOST")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "25"))
+SMTP_USER = os.environ.get("SMTP_USER")
+SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD")
+SMTP_TLS = os.environ.get("SMTP_TLS", "0") == "1"
+SMTP_FROM = os.environ.get("SMTP_FROM", "garantias@localhost")
+POR_MINUTO = int(os.environ.get("NOTIFICACIONES_POR_MINUTO", "30"))
+LOTE = int(os.environ.get("NOTIFICACIONES_LOTE", "20"))
+HABILITADAS = bool(SMTP_HOST)
+
+MAX_INTENTOS = 5
+ESPERA_SONDEO = 2.0  # segundos entre consultas cuando no hay pendientes
+ESPERA_REINTENTO = 60  # segundos; se duplica en cada reintento
+DIAS_RETENCION = 30  # las notificaciones enviadas se borran después de esto
+
+# evento -> (asunto, cuerpo, adjuntar recibo). Campos: {id} {cliente} {producto} {estado} {empresa} {contacto}
+PLANTILLAS = {
+    "registro": (
+        "Recibimos su equipo - garantía #{id}",
+        "Hola {cliente},\n\nRecibimos su {producto} para revisión de garantía con el número #{id}.\n"
+        "Adjuntamos el recibo; le avisaremos por este medio cada vez que cambie el estado.\n\n{empresa}\n{contacto}",
+        True,
+    ),
+    "En Validacion": (
+        "Garantía #{id}: en validación",
+        "Hola {cliente},\n\nEstamos revisando su {producto} (garantía #{id}) para confirmar si aplica la garantía.\n\n{empresa}\n{contacto}",
+        False,
+    ),
+    "Enviado": (
+        "Garantía #{id}: enviada al fabricante",
+        "Hola {cliente},\n\nSu {producto} (garantía #{id}) fue enviado al fabricante o centro de servicio.\n\n{empresa}\n{contacto}",
+        False,
+    ),
+    "Esperando Respuesta": (
+        "Garantía #{id}: esperando respuesta",
+        "Hola {cliente},\n\nEstamos esperando la respuesta del fabricante sobre su {producto} (garantía #{id}).\n\n{empresa}\n{contacto}",
+        False,
+    ),
+    "Resuelta": (
+        "Garantía #{id}: resuelta",
+        "Hola {cliente},\n\nSu garantía #{id} fue resuelta. Puede pasar a recoger su {producto}; traiga el recibo.\n\n{empresa}\n{contacto}",
+        True,
+    ),
+    "Rechazada": (
+        "Garantía #{id}: no aplica",
+        "Hola {cliente},\n\nLa garantía #{id} de su {producto} no fue aprobada. Comuníquese con nosotros para más detalles "
+        "y para recoger el equipo.\n\n{empresa}\n{contacto}",
+        False,
+    ),
+}
+
+_hilo = None
+_parar = threading.Event()
+_ultimo_envio = 0.0
+
+def encolar(db, garantia, evento, usuario=None):
+    """Agrega la notificación del evento a la sesión (no hace commit). No hace nada si las
+    notificaciones están desactivadas, el evento no tiene plantilla, el cliente no tiene email
+    o la garantía es de prueba."""
+    if not HABILITADAS or evento not in PLANTILLAS or garantia.es_prueba:
+        return None
+    email = (garantia.email or "").strip()
+    if "@" not in email:
+        return None
+    if garantia.id is None:
+        db.flush()
+    notificacion = Notificacion(garantia_id=garantia.id, evento=evento, destinatario=email, usuario=usuario)
+    db.add(notificacion)
+    return notificacion
+
+def _tomar_lote(db):
+    """Marca como "enviando" hasta LOTE notificaciones pendientes. El UPDATE condicionado
+    evita que dos procesos envíen la misma."""
+    ids = [
+        f[0] for f in db.query(Notificacion.id)
+        .filter(Notificacion.estado == "pendiente", Notificacion.disponible_desde <= now_colombia())
+        .order_by(Notificacion.id)
+        .limit(LOTE)
+    ]
+    tomadas = []
+    for nid in ids:
+        r = db.execute(
+            update(Notificacion)
+            .where(Notificacion.id == nid, Notificacion.estado == "pendiente")
+            .values(estado="enviando", intentos=Notificacion.intentos + 1)
+        )
+        if r.rowcount == 1:
+            tomadas.append(nid)
+    db.commit()
+    return db.query(Notificacion).filter(Notificacion.id.in_(tomadas)).order_by(Notificacion.id).all() if tomadas else []
+
+def _conectar():
+    conn = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+    if SMTP_TLS:
+        conn.starttls()
+    if SMTP_USER:
+        conn.login(SMTP_USER, SMTP_PASSWORD or "")
+    return conn
+
+def armar_mensaje(db, notificacion, config):
+    """Devuelve el EmailMessage de la notificación, o None si su garantía ya no existe."""
+    garantia = obtener_garantia(db, notificacion.garantia_id)
+    if not garantia:
+        return None
+    asunto, cuerpo, adjuntar_recibo = PLANTILLAS[notificacion.evento]
+    producto = " ".join(p for p in (garantia.tipo_producto, garantia.marca, garantia.modelo) if p) or "equipo"
+    contacto = " - ".join(p for p in (config.telefono, config.email, config.direccion) if p)
+    campos = {"id": garantia.id, "cliente": garantia.cliente, "producto": producto, "estado": garantia.estado, "empresa": config.nombre_empresa, "contacto": contacto}
+    msg = EmailMessage()
+    msg["Subject"] = asunto.format(**campos)
+    msg["From"] = formataddr((config.nombre_empresa, SMTP_FROM))
+    msg["To"] = notificacion.destinatario
+    msg.set_content(cuerpo.format(**campos))
+    if adjuntar_recibo:
+        pdf = generar_pdf_recibos([garantia], config, notificacion.usuario or garantia.usuario_asignado or "")
+        msg.add_attachment(pdf, maintype="application", subtype="pdf", filename=f"recibo_garantia_{garantia.id}.pdf")
+    return msg
+
+def _fallo(notificacion, error, permanente=False):
+    notificacion.error = error
+    if permanente or notificacion.intentos >= MAX_INTENTOS:
+        notificacion.estado = "error"
+    else:
+        notificacion.estado = "pendiente"
+        notificacion.disponible_desde = now_colombia() + timedelta(seconds=ESPERA_REINTENTO * 2 ** (notificacion.intentos - 1))
+
+def _esperar_turno():
+    """Limita el ritmo a POR_MINUTO envíos por minuto, también entre un lote y el siguiente."""
+    global _ultimo_envio
+    if POR_MINUTO > 0:
+        espera = _ultimo_envio + 60.0 / POR_MINUTO - time.monotonic()
+        if espera > 0:
+            _parar.wait(espera)
+    _ultimo_envio = time.monotonic()
+
+def enviar_lote(db):
+    """Envía un lote de pendientes reutilizando la conexión SMTP. Devuelve cuántas se tomaron."""
+    lote = _tomar_lote(db)
+    if not lote:
+        return 0
+    config = db.query(ConfiguracionEmpresa).first() or ConfiguracionEmpresa(nombre_empresa="JD Soluciones")
+    conn = None
+    try:
+        for notificacion in lote:
+            try:
+                msg = armar_mensaje(db, notificacion, config)
+                if msg is None:
+                    _fallo(notificacion, "Garantía no encontrada", permanente=True)
+                else:
+                    _esperar_turno()
+                    if conn is None:
+                        conn = _conectar()
+                    conn.send_message(msg)
+                    notificacion.estado = "enviada"
+                    notificacion.error = None
+                    notificacion.fecha_envio = now_colombia()
+            except smtplib.SMTPRecipientsRefused as e:
+                _fallo(notificacion, f"Destinatario rechazado: {e.recipients}", permanente=True)
+            except (smtplib.SMTPException, OSError) as e:
+                _fallo(notificacion, f"{type(e).__name__}: {e}")
+                # La conexión puede haber quedado inservible: se abre otra para el siguiente
+                if conn is not None:
+                    try:
+                        conn.close()
+                    finally:
+                        conn = None
+            except Exception:
+                _fallo(notificacion, traceback.format_exc(limit=3), permanente=True)
+            db.commit()
+    finally:
+        if conn is not None:
+            try:
+                conn.quit()
+            except smtplib.SMTPException:
+                conn.close()
+    return len(lote)
+
+def _despachador():
+    while not _parar.is_set():
+        db = SessionLocal()
+        try:
+            n = enviar_lote(db)
+        except Exception:
+            traceback.print_exc()
+            n = 0
+        finally:
+            db.close()
+        if not n:
+            _parar.wait(ESPERA_SONDEO)
+
+def limpiar_enviadas(db, dias=DIAS_RETENCION):
+    corte = now_colombia() - timedelta(days=dias)
+    n = db.query(Notificacion).filter(Notificacion.estado == "enviada", Notificacion.fecha_envio < corte).delete(synchronize_session=False)
+    db.commit()
+    return n
+
+def iniciar_despachador():
+    global _hilo
+    if not HABILITADAS or _hilo:
+        return
+    db = SessionLocal()
+    try:
+        # Las que quedaron a medio enviar si la app se detuvo vuelven a la cola
+        db.query(Notificacion).filter(Notificacion.estado == "enviando").update({Notificacion.estado: "pendiente"}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+    _parar.clear()
+    _hilo = threading.Thread(target=_despachador, name="notificaciones", daemon=True)
+    _hilo.start()
+
+def detener_despachador():
+    global _hilo
+    _parar.set()
+    if _hilo:
+        _hilo.join(timeout=5)
+        _hilo = None
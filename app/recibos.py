@@ -0,0 +1,239 @@
+"""
+Generación del PDF del recibo de garantía (tamaño media carta).
+Lo usan el endpoint /api/garantias/{gid}/recibo y el trabajo de impresión masiva de recibos.
+"""
+import os
+
+def _estilos():
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    
+    styles = getSampleStyleSheet()
+    
+    # Estilos personalizados
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=10,
+        spaceAfter=3,
+        alignment=1  # Centrado
+    )
+    
+    subtitle_style = ParagraphStyle(
+        'CustomSubtitle',
+        parent=styles['Heading2'],
+        fontSize=14,
+        spaceAfter=20,
+        alignment=1
+    )
+    
+    small_style = ParagraphStyle(
+        'SmallText',
+        parent=styles['Normal'],
+        fontSize=9, # Aumentado de 6 a 8
+        spaceAfter=0,
+        leading=11,  # Aumentado para mejorar el interlineado
+        alignment=0  # Alinear a la izquierda para el texto de la empresa
+    )
+    
+    normal_style = styles['Normal']
+    normal_style.spaceAfter = 10
+    
+    # Estilo para política de garantía: letra muy pequeña, justificado
+    policy_style = ParagraphStyle(
+        'PolicyText',
+        parent=styles['Normal'],
+        fontSize=5,
+        leading=6,
+        alignment=4,  # 4 = JUSTIFY en ReportLab
+        spaceBefore=4,
+        spaceAfter=4,
+        leftIndent=0,
+        rightIndent=0,
+    )
+    
+    return {"title_style": title_style, "subtitle_style": subtitle_style, "small_style": small_style, "normal_style": normal_style, "policy_style": policy_style}
+
+def _contenido_recibo(garantia, config, usuario_registro, doc, half_letter, estilos):
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.platypus import Paragraph, Spacer, Table, TableStyle, Image
+    from reportlab.lib import colors
+    from reportlab.lib.units import inch
+    
+    title_style = estilos["title_style"]
+    small_style = estilos["small_style"]
+    normal_style = estilos["normal_style"]
+    policy_style = estilos["policy_style"]
+    
+    # Contenido del PDF
+    content = []
+    
+    # Header con logo y datos de empresa lado a lado
+    logo_cell = []
+    company_info_paragraph = []
+    
+    if config.logo_path and config.logo_path is not None:
+        try:
+            logo_path = os.path.join(os.getcwd(), config.logo_path.lstrip('/'))
+            if os.path.exists(logo_path):
+                logo = Image(logo_path, width=1*inch, height=1*inch)
+                logo_cell.append(logo)
+        except Exception as e:
+            pass  # Ignorar error si no se puede cargar logo
+
+    company_info_text = []
+    if config.nombre_empresa:
+        company_info_text.append(config.nombre_empresa)
+    if config.telefono:
+        company_info_text.append(f"Tel: {config.telefono}")
+    if config.email:
+        company_info_text.append(config.email)
+    if config.direccion:
+        company_info_text.append(config.direccion)
+    if config.ciudad:
+        company_info_text.append(config.ciudad)
+    if config.nit:
+        company_info_text.append(f"NIT: {config.nit}")
+    
+    if company_info_text:
+        company_info_paragraph = [Paragraph("<br/>".join(company_info_text), small_style)]
+    
+    # Solo crear tabla de header si hay algo que mostrar
+    if logo_cell or company_info_paragraph:
+        # Ancho total disponible para contenido (half_letter ancho - leftMargin - rightMargin)
+        available_width = half_letter[0] - (doc.leftMargin + doc.rightMargin)
+        
+        # Calcular anchos de columna para la tabla del encabezado
+        # Una columna para el logo, otra para la información de la empresa
+        logo_width = 1.0 * inch 
+        info_width = available_width - logo_width - 0.1*inch
+        
+        # Asegurar que logo_cell y company_info_paragraph estén listos para la tabla
+        logo_cell_for_table = logo_cell if logo_cell else []
+        info_cell_for_table = company_info_paragraph if company_info_paragraph else [Paragraph("", small_style)]
+        
+        header_table_data = [[logo_cell_for_table, info_cell_for_table]]
+        
+        header_table = Table(header_table_data, colWidths=[logo_width, info_width], hAlign='LEFT')
+        header_table.setStyle(TableStyle([
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('TOPPADDING', (1, 0), (1, 0), 0.1*inch),
+            ('LEFTPADDING', (0, 0), (-1, -1), 0),
+            ('RIGHTPADDING', (0, 0), (-1, -1), 0),
+            ('TOPPADDING', (0, 0), (0, -1), 0),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 0),
+            ('ALIGN', (0, 0), (0, -1), 'LEFT'),
+            ('ALIGN', (1, 0), (1, -1), 'LEFT'),
+        ]))
+        content.append(header_table)
+        content.append(Spacer(1, 2))
+    
+    # Título
+    content.append(Spacer(1, 8))
+    content.append(Paragraph(f"RECIBO DE GARANTÍA #{garantia.id}", title_style))
+    content.append(Spacer(1, 3))
+    
+    # Información básica en tabla
+    data = []
+    
+    # Agregar filas de datos
+    data.append(["Fecha y Hora:", garantia.fecha_registro.strftime('%d/%m/%Y %H:%M:%S')])
+    if garantia.fecha_compra:
+        data.append(["Fecha Compra:", garantia.fecha_compra])
+    data.append(["Cliente:", garantia.cliente])
+    if garantia.telefono:
+        data.append(["Teléfono:", garantia.telefono])
+    if garantia.email:
+        data.append(["Email:", garantia.email])
+
+    # Combinar producto en una sola línea
+    producto_parts = []
+    if garantia.tipo_producto:
+        producto_parts.append(garantia.tipo_producto)
+    if garantia.marca:
+        producto_parts.append(garantia.marca)
+    if garantia.modelo:
+        producto_parts.append(garantia.modelo)
+    producto_desc = " ".join(producto_parts)
+    if producto_desc:
+        data.append(["Producto:", producto_desc])
+    
+    if garantia.serial:
+        data.append(["Serial:", garantia.serial])
+    if garantia.factura:
+        data.append(["Factura:", garantia.factura])
+    data.append(["Usuario:", usuario_registro])
+    if garantia.descripcion_falla:
+        data.append(["Fallo:", garantia.descripcion_falla])
+    data.append(["Estado:", garantia.estado])
+    
+    # Crear tabla
+    table = Table(data, colWidths=[1.5*inch, 3.5*inch])  # Reducido para media carta
+    
+    # Construir estilos dinámicamente basado en el número real de filas
+    table_styles = [
+        ('BACKGROUND', (0, 0), (-1, -1), colors.white),
+        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 3),
+        ('TOPPADDING', (0, 0), (-1, -1), 3),
+        ('LEFTPADDING', (0, 0), (-1, -1), 3),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 3),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.lightgrey),
+    ]
+    
+    # Agregar fondos alternos solo para filas que existen
+    num_rows = len(data)
+    for i in range(1, num_rows, 2):  # Filas impares con fondo gris
+        table_styles.append(('BACKGROUND', (0, i), (-1, i), colors.whitesmoke))
+    
+    table.setStyle(TableStyle(table_styles))
+    
+    content.append(table)
+    content.append(Spacer(1, 6))
+    
+    # Política de garantía (texto justificado, letra muy pequeña)
+    politica_texto = (
+        "EL PRESENTE DOCUMENTO NO SIGNIFICA QUE ACEPTAMOS LA GARANTÍA; SIGNIFICA QUE ESTAMOS RECIBIENDO EL EQUIPO "
+        "PARA REVISARLO Y CONFIRMAR SI APLICA O NO DICHA GARANTÍA. Después de 30 días a partir de la fecha, se cobrará "
+        "bodegaje a razón de quinientos pesos ($500) por día. Transcurridos 90 días, se considera que el dispositivo ha "
+        "sido abandonado. En caso de pérdida o daño por fuerza mayor no se responderá por el mismo."
+    )
+    content.append(Paragraph(politica_texto, policy_style))
+    content.append(Spacer(1, 4))
+    
+    # Firma
+    content.append(Paragraph("______________________________", ParagraphStyle('Firma', parent=normal_style, alignment=1)))
+    content.append(Paragraph("Firma del cliente", ParagraphStyle('FirmaLabel', parent=normal_style, alignment=1, spaceAfter=10)))
+    return content
+
+def generar_pdf_recibos(garantias, config, usuario_registro):
+    """Devuelve los bytes de un PDF con un recibo por página para cada garantía."""
+    from reportlab.platypus import SimpleDocTemplate, PageBreak
+    from reportlab.lib.units import inch
+    from io import BytesIO
+    
+    # Tamaño media carta (8.5 x 5.5 pulgadas)
+    half_letter = (8.5*inch, 5.5*inch)
+    
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(
+        buffer, 
+        pagesize=half_letter,
+        topMargin=0.1*inch,  # Margen superior más mínimo
+        bottomMargin=0.1*inch,
+        leftMargin=0.5*inch,
+        rightMargin=0.5*inch
+    )
+    estilos = _estilos()
+    
+    content = []
+    for i, garantia in enumerate(garantias):
+        if i:
+            content.append(PageBreak())
+        content.extend(_contenido_recibo(garantia, config, usuario_registro, doc, half_letter, estilos))
+    
+    # Generar PDF
+    doc.build(content)
+    return buffer.getvalue()
@@ -0,0 +1,126 @@
+"""
+Búsqueda por serial/factura y detección de reincidencias.
+
+serial_norm y factura_norm guardan el código normalizado (solo letras y números, en
+mayúsculas) e indexado, para encontrar en una consulta las garantías previas de un equipo
+aunque el serial se haya escrito con espacios o guiones distintos.
+
+La tabla reincidencias_modelo se actualiza al registrar cada garantía (contar_garantia);
+recalcular_reincidencias() la reconstruye completa desde cero (también tras una purga).
+"""
+import re
+from functools import lru_cache
+from sqlalchemy import select, union_all, literal, or_, desc, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Garantia, GarantiaArchivada, ReincidenciaModelo
+
+LOTE_NORMALIZAR = 500
+LIMITE_PREVIAS = 20
+
+def normalizar_codigo(codigo):
+    """Deja solo letras y números en mayúsculas (" sn-123 45 " -> "SN12345"); None si queda vacío."""
+    return re.sub(r"[^0-9A-Za-z]", "", codigo or "").upper() or None
+
+def _clave_modelo(valor):
+    return " ".join((valor or "").upper().split())
+
+@lru_cache(maxsize=None)
+def _consulta_previas(por_serial, por_factura):
+    """La consulta se arma una vez por combinación de filtros; en cada llamada solo cambian los parámetros."""
+    selects = []
+    for modelo, archivada in ((Garantia, False), (GarantiaArchivada, True)):
+        condiciones = []
+        if por_serial:
+            condiciones.append(modelo.serial_norm == bindparam("serial_norm"))
+        if por_factura:
+            condiciones.append(modelo.factura_norm == bindparam("factura_norm"))
+        selects.append(
+            select(modelo.id, modelo.cliente, modelo.cedula, modelo.marca, modelo.modelo, modelo.serial, modelo.factura, modelo.estado, modelo.fecha_registro, literal(archivada).label("archivada"))
+            .where(or_(*condiciones))
+        )
+    return union_all(*selects).order_by(desc("fecha_registro")).limit(bindparam("limite"))
+
+def previas(db, serial=None, factura=None, limite=LIMITE_PREVIAS):
+    """Garantías (activas y archivadas) con el mismo serial o factura, más recientes primero.
+    Una sola consulta UNION ALL sobre los índices de serial_norm/factura_norm."""
+    serial_norm, factura_norm = normalizar_codigo(serial), normalizar_codigo(factura)
+    if not serial_norm and not factura_norm:
+        return []
+    consulta = _consulta_previas(bool(serial_norm), bool(factura_norm))
+    filas = db.execute(consulta, {"serial_norm": serial_norm, "factura_norm": factura_norm, "limite": limite}).mappings().all()
+    return [dict(f, fecha_registro=f["fecha_registro"].isoformat() if f["fecha_registro"] else None, archivada=bool(f["archivada"])) for f in filas]
+
+def advertencias(garantias_previas, serial=None, factura=None):
+    serial_norm, factura_norm = normalizar_codigo(serial), normalizar_codigo(factura)
+    por_serial = [p["id"] for p in garantias_previas if serial_norm and normalizar_codigo(p["serial"]) == serial_norm]
+    por_factura = [p["id"] for p in garantias_previas if factura_norm and normalizar_codigo(p["factura"]) == factura_norm]
+    out = []
+    if por_serial:
+        out.append(f"El serial ya tiene {len(por_serial)} garantía(s) previa(s): " + ", ".join(f"#{i}" for i in por_serial))
+    if por_factura:
+        out.append(f"La factura ya aparece en {len(por_factura)} garantía(s) previa(s): " + ", ".join(f"#{i}" for i in por_factura))
+    return out
+
+def contar_garantia(db, marca, modelo, reincidente):
+    """Suma la garantía al reporte de su marca/modelo, en la misma transacción del registro. No hace commit."""
+    stmt = sqlite_insert(ReincidenciaModelo).values(marca=_clave_modelo(marca), modelo=_clave_modelo(modelo), garantias=1, reincidencias=1 if reincidente else 0)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["marca", "modelo"],
+        set_={"garantias": ReincidenciaModelo.garantias + 1, "reincidencias": ReincidenciaModelo.reincidencias + stmt.excluded.reincidencias},
+    ))
+
+def reporte(db, limite=20):
+    filas = db.query(ReincidenciaModelo).filter(ReincidenciaModelo.reincidencias > 0).order_by(ReincidenciaModelo.reincidencias.desc(), ReincidenciaModelo.garantias.desc()).limit(limite).all()
+    return [{"marca": r.marca, "modelo": r.modelo, "garantias": r.garantias, "reincidencias": r.reincidencias, "tasa": round(r.reincidencias / r.garantias, 3) if r.garantias else 0} for r in filas]
+
+def _sin_normalizar(modelo):
+    """Filas con serial o factura cuyo código normalizado aún no se ha calculado."""
+    return or_(
+        (modelo.serial_norm.is_(None)) & (modelo.serial.isnot(None)) & (modelo.serial != ""),
+        (modelo.factura_norm.is_(None)) & (modelo.factura.isnot(None)) & (modelo.factura != ""),
+    )
+
+def normalizar_pendientes(db, lote=LOTE_NORMALIZAR):
+    """Rellena serial_norm/factura_norm de las garantías anteriores a estas columnas."""
+    total = 0
+    for modelo in (Garantia, GarantiaArchivada):
+        pendiente = _sin_normalizar(modelo)
+        ultimo_id = 0
+        while True:
+            garantias = db.query(modelo).filter(pendiente, modelo.id > ultimo_id).order_by(modelo.id).limit(lote).all()
+            if not garantias:
+                break
+            ultimo_id = garantias[-1].id
+            for g in garantias:
+                g.serial_norm = normalizar_codigo(g.serial)
+                g.factura_norm = normalizar_codigo(g.factura)
+            db.commit()
+            total += len(garantias)
+    return total
+
+def hay_pendientes(db):
+    return any(db.query(modelo.id).filter(_sin_normalizar(modelo)).first() is not None for modelo in (Garantia, GarantiaArchivada))
+
+def recalcular_reincidencias(db, progreso=None):
+    """Reconstruye reincidencias_modelo recorriendo todas las garantías en orden de registro."""
+    consulta = union_all(
+        select(Garantia.serial_norm, Garantia.marca, Garantia.modelo, Garantia.fecha_registro, Garantia.id),
+        select(GarantiaArchivada.serial_norm, GarantiaArchivada.marca, GarantiaArchivada.modelo, GarantiaArchivada.fecha_registro, GarantiaArchivada.id),
+    ).order_by("fecha_registro", "id")
+    conteo, vistos = {}, set()
+    for serial_norm, marca, modelo, _, _ in db.execute(consulta):
+        clave = (_clave_modelo(marca), _clave_modelo(modelo))
+        garantias, reincidencias = conteo.get(clave, (0, 0))
+        reincidente = bool(serial_norm) and serial_norm in vistos
+        conteo[clave] = (garantias + 1, reincidencias + (1 if reincidente else 0))
+        if serial_norm:
+            vistos.add(serial_norm)
+    if progreso:
+        progreso(80)
+    try:
+        db.query(ReincidenciaModelo).delete()
+        db.add_all([ReincidenciaModelo(marca=m, modelo=mo, garantias=g, reincidencias=r) for (m, mo), (g, r) in conteo.items()])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
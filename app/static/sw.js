@@ -0,0 +1,43 @@
+// Service worker: guarda la interfaz (index.html y Bootstrap) para que abra sin conexión.
+// Estrategia stale-while-revalidate: responde con la copia guardada y la actualiza en segundo plano.
+// Los datos de /api/ no pasan por aquí: la página los guarda en IndexedDB (ver index.html).
+const CACHE = 'garantias-shell-v1';
+const SHELL = [
+  '/',
+  'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css',
+  'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/js/bootstrap.bundle.min.js',
+];
+
+self.addEventListener('install', (e)=>{
+  e.waitUntil(caches.open(CACHE).then(c => c.addAll(SHELL)).then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', (e)=>{
+  e.waitUntil(
+    caches.keys()
+      .then(keys => Promise.all(keys.filter(k => k !== CACHE).map(k => caches.delete(k))))
+      .then(() => self.clients.claim())
+  );
+});
+
+self.addEventListener('fetch', (e)=>{
+  const req = e.request;
+  if(req.method !== 'GET') return;
+  const url = new URL(req.url);
+  const esInicio = url.origin === location.origin && url.pathname === '/';
+  if(!esInicio && !SHELL.includes(req.url)) return;
+  // "/" y "/?x=1" usan la misma copia de index.html
+  const clave = esInicio ? '/' : req;
+  e.respondWith(caches.open(CACHE).then(async cache => {
+    const guardada = await cache.match(clave);
+    const red = fetch(req).then(res => {
+      if(res.ok) cache.put(clave, res.clone());
+      return res;
+    });
+    if(guardada){
+      e.waitUntil(red.catch(() => {}));
+      return guardada;
+    }
+    return red;
+  }));
+});
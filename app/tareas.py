@@ -0,0 +1,79 @@
+"""
+Tareas que se ejecutan en segundo plano con la cola de trabajos (ver trabajos.py).
+"""
+from models import Garantia, GarantiaArchivada, ConfiguracionEmpresa, now_colombia
+from trabajos import tarea, ruta_resultado
+from recibos import generar_pdf_recibos
+from clientes import vincular_garantias
+from reincidencias import normalizar_pendientes, recalcular_reincidencias
+from cambios import compactar_cambios, purgar_cambios
+
+LOTE_EXPORTACION = 500
+
+@tarea("exportar_garantias")
+def exportar_garantias(db, parametros, progreso):
+    from openpyxl import Workbook
+    total = db.query(Garantia).count()
+    columnas = ["id", "cliente", "cedula", "telefono", "email", "tipo_producto", "marca", "modelo", "serial", "factura", "fecha_compra", "descripcion_falla", "estado", "fecha_registro"]
+    # write_only escribe fila a fila sin mantener todo el libro en memoria
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(columnas)
+    # Lotes por id (no un cursor abierto): progreso() hace commit en otra conexión, y con un
+    # SELECT a medio leer SQLite respondería "database is locked"
+    campos = [getattr(Garantia, c) for c in columnas]
+    hechas, ultimo_id = 0, None
+    while True:
+        q = db.query(*campos)
+        if ultimo_id is not None:
+            q = q.filter(Garantia.id < ultimo_id)
+        filas = q.order_by(Garantia.id.desc()).limit(LOTE_EXPORTACION).all()
+        if not filas:
+            break
+        ultimo_id = filas[-1].id
+        for f in filas:
+            ws.append([*f[:-1], f.fecha_registro.isoformat() if f.fecha_registro else None])
+        hechas += len(filas)
+        progreso(90 * hechas / total)
+    path = ruta_resultado(parametros["trabajo_id"], ".xlsx")
+    wb.save(path)
+    return path, f"garantias_export_{now_colombia().strftime('%Y%m%d%H%M%S')}.xlsx"
+
+@tarea("recibos")
+def imprimir_recibos(db, parametros, progreso):
+    """Un solo PDF con el recibo de cada garantía indicada (una por página)."""
+    config = db.query(ConfiguracionEmpresa).first() or ConfiguracionEmpresa()
+    ids = parametros["ids"]
+    por_id = {}
+    for i in range(0, len(ids), LOTE_EXPORTACION):
+        lote = ids[i:i + LOTE_EXPORTACION]
+        # Activas y, para las que falten, archivadas
+        for modelo in (Garantia, GarantiaArchivada):
+            faltan = [gid for gid in lote if gid not in por_id]
+            if faltan:
+                por_id.update({g.id: g for g in db.query(modelo).filter(modelo.id.in_(faltan)).all()})
+        progreso(30 * (i + len(lote)) / len(ids))
+    garantias = [por_id[gid] for gid in ids if gid in por_id]
+    pdf = generar_pdf_recibos(garantias, config, parametros.get("usuario"))
+    path = ruta_resultado(parametros["trabajo_id"], ".pdf")
+    with open(path, "wb") as f:
+        f.write(pdf)
+    return path, f"recibos_garantias_{now_colombia().strftime('%Y%m%d%H%M%S')}.pdf"
+
+@tarea("vincular_clientes")
+def vincular_clientes(db, parametros, progreso):
+    vincular_garantias(db, progreso=progreso)
+
+@tarea("reincidencias")
+def reporte_reincidencias(db, parametros, progreso):
+    """Normaliza serial/factura de garantías antiguas y reconstruye el reporte de reincidencias."""
+    normalizar_pendientes(db)
+    progreso(50)
+    recalcular_reincidencias(db)
+
+@tarea("historial")
+def mantener_historial(db, parametros, progreso):
+    """Retención y compactación de la tabla de cambios."""
+    purgar_cambios(db)
+    progreso(10)
+    compactar_cambios(db, progreso=lambda n: progreso(10 + 0.9 * n))
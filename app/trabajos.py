@@ -0,0 +1,179 @@
+"""
+Cola de trabajos en segundo plano guardada en la propia base de datos (tabla "trabajos").
+
+- encolar() crea el trabajo y devuelve enseguida; el endpoint responde con el id.
+- Un pool de hilos (TRABAJOS_WORKERS, por defecto 2) toma los trabajos pendientes,
+  ejecuta la función registrada para su tipo con @tarea("tipo") y guarda el resultado
+  en data/trabajos/. Si falla se reintenta con espera creciente hasta max_intentos.
+- El cliente consulta /api/jobs/{id} para ver el progreso y descarga el resultado al terminar.
+- Las funciones de mantenimiento registradas con @periodica(cada) las ejecuta uno de los
+  workers al arrancar y luego cada `cada`, mientras la app siga en marcha.
+"""
+import os, json, time, uuid, threading, traceback
+from datetime import timedelta
+from sqlalchemy import update
+from database import SessionLocal
+from models import Trabajo, now_colombia
+
+RESULTADOS_DIR = os.path.join(os.getcwd(), "data", "trabajos")
+WORKERS = int(os.environ.get("TRABAJOS_WORKERS", "2"))
+ESPERA_SONDEO = 1.0  # segundos entre consultas cuando no hay trabajos
+ESPERA_REINTENTO = 10  # segundos; se duplica en cada reintento
+DIAS_RETENCION = 7  # los trabajos terminados y sus archivos se borran después de esto
+
+TAREAS = {}
+PERIODICAS = []
+_hilos = []
+_parar = threading.Event()
+_periodicas_lock = threading.Lock()
+
+def tarea(tipo):
+    """Registra la función que procesa los trabajos de `tipo`.
+    La función recibe (db, parametros, progreso) y devuelve (ruta_archivo, nombre_descarga) o None.
+    `parametros` incluye "trabajo_id"; `progreso(n)` guarda el avance (0-100)."""
+    def registrar(func):
+        TAREAS[tipo] = func
+        return func
+    return registrar
+
+def periodica(cada):
+    """Registra una función de mantenimiento que recibe (db) y se ejecuta cada `cada` (timedelta)."""
+    def registrar(func):
+        PERIODICAS.append({"func": func, "cada": cada.total_seconds(), "proxima": 0.0})
+        return func
+    return registrar
+
+def encolar(db, tipo, parametros=None, usuario=None, max_intentos=3):
+    if tipo not in TAREAS:
+        raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+    trabajo = Trabajo(id=uuid.uuid4().hex, tipo=tipo, estado="pendiente", parametros=json.dumps(parametros or {}), usuario=usuario, max_intentos=max_intentos)
+    db.add(trabajo)
+    db.commit()
+    return trabajo
+
+def ruta_resultado(trabajo_id, extension):
+    os.makedirs(RESULTADOS_DIR, exist_ok=True)
+    return os.path.join(RESULTADOS_DIR, f"{trabajo_id}{extension}")
+
+def trabajo_dict(t):
+    return {"id": t.id, "tipo": t.tipo, "estado": t.estado, "progreso": t.progreso, "intentos": t.intentos, "error": t.error, "resultado": f"/api/jobs/{t.id}/resultado" if t.estado == "completado" and t.resultado_path else None, "fecha_creacion": t.fecha_creacion.isoformat(), "fecha_actualizacion": t.fecha_actualizacion.isoformat() if t.fecha_actualizacion else None}
+
+def _tomar_trabajo(db):
+    """Marca como en_proceso el siguiente trabajo pendiente. El UPDATE condicionado
+    evita que dos hilos tomen el mismo trabajo."""
+    while True:
+        fila = (
+            db.query(Trabajo.id)
+            .filter(Trabajo.estado == "pendiente", Trabajo.disponible_desde <= now_colombia())
+            .order_by(Trabajo.fecha_creacion)
+            .first()
+        )
+        if not fila:
+            return None
+        r = db.execute(
+            update(Trabajo)
+            .where(Trabajo.id == fila[0], Trabajo.estado == "pendiente")
+            .values(estado="en_proceso", intentos=Trabajo.intentos + 1, fecha_actualizacion=now_colombia())
+        )
+        db.commit()
+        if r.rowcount == 1:
+            return db.get(Trabajo, fila[0])
+
+def _ejecutar(db, trabajo):
+    def progreso(n):
+        # Sesión aparte: un commit en `db` expiraría los objetos que la tarea está recorriendo
+        s = SessionLocal()
+        try:
+            s.execute(update(Trabajo).where(Trabajo.id == trabajo.id).values(progreso=max(0, min(int(n), 100)), fecha_actualizacion=now_colombia()))
+            s.commit()
+        finally:
+            s.close()
+
+    try:
+        parametros = json.loads(trabajo.parametros or "{}")
+        parametros["trabajo_id"] = trabajo.id
+        resultado = TAREAS[trabajo.tipo](db, parametros, progreso)
+        trabajo = db.get(Trabajo, trabajo.id)
+        if resultado:
+            trabajo.resultado_path, trabajo.resultado_nombre = resultado
+        trabajo.estado = "completado"
+        trabajo.progreso = 100
+        trabajo.error = None
+        db.commit()
+    except Exception:
+        db.rollback()
+        trabajo = db.get(Trabajo, trabajo.id)
+        trabajo.error = traceback.format_exc(limit=3)
+        if trabajo.intentos < trabajo.max_intentos:
+            trabajo.estado = "pendiente"
+            trabajo.disponible_desde = now_colombia() + timedelta(seconds=ESPERA_REINTENTO * 2 ** (trabajo.intentos - 1))
+        else:
+            trabajo.estado = "error"
+        db.commit()
+
+def _ejecutar_periodicas(db):
+    # Solo un hilo a la vez; los demás siguen tomando trabajos
+    if not _periodicas_lock.acquire(blocking=False):
+        return
+    try:
+        for p in PERIODICAS:
+            ahora = time.monotonic()
+            if ahora < p["proxima"]:
+                continue
+            p["proxima"] = ahora + p["cada"]
+            try:
+                p["func"](db)
+            except Exception:
+                db.rollback()
+                traceback.print_exc()
+    finally:
+        _periodicas_lock.release()
+
+def _worker():
+    while not _parar.is_set():
+        db = SessionLocal()
+        try:
+            _ejecutar_periodicas(db)
+            trabajo = _tomar_trabajo(db)
+            if trabajo:
+                _ejecutar(db, trabajo)
+        except Exception:
+            traceback.print_exc()
+            trabajo = None
+        finally:
+            db.close()
+        if not trabajo:
+            _parar.wait(ESPERA_SONDEO)
+
+@periodica(timedelta(hours=6))
+def limpiar_trabajos_antiguos(db, dias=DIAS_RETENCION):
+    corte = now_colombia() - timedelta(days=dias)
+    viejos = db.query(Trabajo).filter(Trabajo.estado.in_(("completado", "error")), Trabajo.fecha_actualizacion < corte).all()
+    for t in viejos:
+        if t.resultado_path and os.path.isfile(t.resultado_path):
+            os.remove(t.resultado_path)
+        db.delete(t)
+    db.commit()
+    return len(viejos)
+
+def iniciar_workers(n=WORKERS):
+    if _hilos:
+        return
+    db = SessionLocal()
+    try:
+        # Trabajos que quedaron a medias si la app se detuvo: se vuelven a encolar
+        db.query(Trabajo).filter(Trabajo.estado == "en_proceso").update({Trabajo.estado: "pendiente"}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+    _parar.clear()
+    for i in range(n):
+        hilo = threading.Thread(target=_worker, name=f"trabajos-{i}", daemon=True)
+        hilo.start()
+        _hilos.append(hilo)
+
+def detener_workers():
+    _parar.set()
+    for hilo in _hilos:
+        hilo.join(timeout=5)
+    _hilos.clear()